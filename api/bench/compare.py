@@ -0,0 +1,62 @@
+import argparse
+import json
+import sys
+
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'cpu_ms', 'sql_mean')
+
+
+def change(before: float, after: float) -> float | None:
+    if not before:
+        return None
+
+    return (after - before) / before * 100
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare two bench/run.py result files.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument(
+        '--threshold', type=float, default=None,
+        help='exit with 1 when any route p95 latency grows by more than this many percent'
+    )
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)['routes']
+
+    with open(args.after) as file:
+        after = json.load(file)['routes']
+
+    regressions = []
+    print(f'{"route":<36}' + ''.join(f'{metric:>22}' for metric in METRICS))
+
+    for name in (name for name in after if name in before):
+        cells = []
+
+        for metric in METRICS:
+            if metric not in before[name] or metric not in after[name]:
+                cells.append('-'.rjust(22))
+                continue
+
+            difference = change(before[name][metric], after[name][metric])
+            suffix = '' if difference is None else f' ({difference:+.0f}%)'
+            cells.append(f'{after[name][metric]:>.2f}{suffix}'.rjust(22))
+
+        print(f'{name:<36}' + ''.join(cells))
+
+        difference = change(before[name]['p95_ms'], after[name]['p95_ms'])
+        if args.threshold is not None and difference is not None and difference > args.threshold:
+            regressions.append(name)
+
+    for name in sorted(before.keys() ^ after.keys()):
+        print(f'{name:<36} only in {"before" if name in before else "after"}')
+
+    if regressions:
+        print(f'p95 regressed by more than {args.threshold}%: {", ".join(regressions)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
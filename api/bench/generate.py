@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import decimal
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+from sqlalchemy import text  # noqa: E402
+
+from config import get_settings  # noqa: E402
+from db.engine import SessionManager  # noqa: E402
+from db.models import Base  # noqa: E402
+from routers.analytics import KITCHEN_TIME_BUCKETS  # noqa: E402
+
+
+STEPS = (
+    (
+        'ingredients',
+        '''
+        INSERT INTO ingredient (name, available)
+        SELECT 'ingredient-' || g, 100000 + (g * 7919) % 900000
+        FROM generate_series(1, :ingredients) AS g
+        ''',
+    ),
+    (
+        'opening stock',
+        '''
+        INSERT INTO stock_movement (ingredient_id, delta, reason)
+        SELECT id, available, 'CORRECTION' FROM ingredient WHERE available <> 0
+        ''',
+    ),
+    (
+        'positions',
+        '''
+        INSERT INTO position (name, description, is_changable, cost)
+        SELECT 'position-' || g, 'generated position ' || g, g % 4 = 0, 50 + (g * 104729) % 950
+        FROM generate_series(1, :positions) AS g
+        ''',
+    ),
+    (
+        'recipes',
+        '''
+        INSERT INTO position_xref_ingredient (position_id, ingredient_id, count, makeable)
+        SELECT position.id, (position.id * 7919 + k * 104729) % :ingredients + 1, 1 + (position.id + k) % 3, 0
+        FROM position, generate_series(1, 3 + position.id % 6) AS k
+        ON CONFLICT DO NOTHING
+        ''',
+    ),
+    (
+        'makeable',
+        '''
+        UPDATE position_xref_ingredient SET makeable = ingredient.available / position_xref_ingredient.count
+        FROM ingredient WHERE ingredient.id = position_xref_ingredient.ingredient_id
+        ''',
+    ),
+    (
+        'orders',
+        '''
+        INSERT INTO "order" (table_id, status, created_at, updated_at, ended_at, progress_at, ready_at, issued_at)
+        SELECT
+            1 + g % 40,
+            status,
+            created_at,
+            created_at + interval '10 minutes',
+            CASE WHEN status = 'ISSUED' THEN issued_at END,
+            CASE WHEN status <> 'ACCEPTED' THEN created_at + interval '1 minute' END,
+            CASE WHEN status IN ('READY', 'ISSUED') THEN ready_at END,
+            CASE WHEN status = 'ISSUED' THEN issued_at END
+        FROM generate_series(1, :orders) AS g,
+             LATERAL (SELECT now() - (:orders - g) * interval '1 second' * :spread AS created_at) AS times,
+             LATERAL (SELECT
+                CASE WHEN g > :orders - :current THEN (ARRAY['ACCEPTED', 'PROGRESS', 'READY'])[1 + g % 3]::orderstatus
+                     ELSE 'ISSUED'::orderstatus END AS status,
+                created_at + (240 + g::bigint * 7919 % 1500) * interval '1 second' AS ready_at
+             ) AS state,
+             LATERAL (SELECT ready_at + (30 + g::bigint * 104729 % 900) * interval '1 second' AS issued_at) AS issue
+        ''',
+    ),
+    (
+        'order lines',
+        '''
+        INSERT INTO position_xref_order (order_id, position_id, count, price)
+        SELECT "order".id, position.id, 1 + ("order".id + k) % 3, position.cost
+        FROM "order", generate_series(1, 1 + "order".id % 4) AS k, position
+        WHERE position.id = ("order".id * 31 + k * 7919) % :positions + 1
+        ''',
+    ),
+    # what the generated orders took, the opening balances grow by the same amount and start with the first order,
+    # so the ledger still sums up to ingredient.available
+    (
+        'stock consumption',
+        '''
+        WITH consumed AS (
+            INSERT INTO stock_movement (ingredient_id, delta, reason, order_id, created_at)
+            SELECT recipe.ingredient_id, -sum(line.count * recipe.count), 'CONSUMPTION', "order".id, "order".created_at
+            FROM "order"
+            JOIN position_xref_order AS line ON line.order_id = "order".id
+            JOIN position_xref_ingredient AS recipe ON recipe.position_id = line.position_id
+            GROUP BY "order".id, recipe.ingredient_id
+            ORDER BY "order".id, recipe.ingredient_id
+            RETURNING ingredient_id, delta, created_at
+        )
+        UPDATE stock_movement SET delta = stock_movement.delta - totals.delta, created_at = totals.first_at
+        FROM (
+            SELECT ingredient_id, sum(delta) AS delta, min(created_at) AS first_at FROM consumed GROUP BY ingredient_id
+        ) AS totals
+        WHERE stock_movement.reason = 'CORRECTION' AND stock_movement.ingredient_id = totals.ingredient_id
+        ''',
+    ),
+    (
+        'order totals',
+        '''
+        UPDATE "order" SET cost = totals.cost
+        FROM (SELECT order_id, sum(price * count) AS cost FROM position_xref_order GROUP BY order_id) AS totals
+        WHERE "order".id = totals.order_id
+        ''',
+    ),
+    *(
+        (
+            table,
+            f'''
+            INSERT INTO {table} (position_id, period, units, revenue, issued_units, issued_revenue)
+            SELECT line.position_id, date_trunc('{granularity}', "order".created_at, :timezone),
+                   sum(line.count), sum(line.count * line.price),
+                   coalesce(sum(line.count) FILTER (WHERE "order".status = 'ISSUED'), 0),
+                   coalesce(sum(line.count * line.price) FILTER (WHERE "order".status = 'ISSUED'), 0)
+            FROM position_xref_order AS line
+            JOIN "order" ON "order".id = line.order_id
+            GROUP BY 1, 2
+            ''',
+        ) for table, granularity in (('sales_hourly', 'hour'), ('sales_daily', 'day'))
+    ),
+    *(
+        (
+            table,
+            f'''
+            INSERT INTO {table} ({'position_id, ' if by_position else ''}period, stage, bucket, orders)
+            SELECT {'line.position_id, ' if by_position else ''}date_trunc('hour', "order".created_at, :timezone), stage,
+                   width_bucket(extract(epoch FROM finished - started), :buckets), count(DISTINCT "order".id)
+            FROM "order"
+            {'JOIN position_xref_order AS line ON line.order_id = "order".id' if by_position else ''}
+            CROSS JOIN LATERAL (VALUES
+                ('PREPARING'::kitchenstage, "order".created_at, "order".ready_at),
+                ('WAITING'::kitchenstage, "order".ready_at, "order".issued_at),
+                ('TOTAL'::kitchenstage, "order".created_at, "order".issued_at)
+            ) AS stages (stage, started, finished)
+            WHERE finished IS NOT NULL AND started IS NOT NULL
+            GROUP BY {'1, 2, 3, 4' if by_position else '1, 2, 3'}
+            ''',
+        ) for table, by_position in (('kitchen_time_hourly', False), ('position_kitchen_time_hourly', True))
+    ),
+    ('analyze', 'ANALYZE'),
+)
+
+
+async def generate(args: argparse.Namespace) -> None:
+    engine = SessionManager().async_engine
+    params = {
+        'ingredients': args.ingredients,
+        'positions': args.positions,
+        'orders': args.orders,
+        'current': min(args.current, args.orders),
+        'timezone': get_settings().ANALYTICS_TIMEZONE,
+        'buckets': list(map(decimal.Decimal, KITCHEN_TIME_BUCKETS)),
+        # spread order history over roughly half a year
+        'spread': max(1.0, 180 * 24 * 3600 / max(args.orders, 1)),
+    }
+
+    if args.reset:
+        tables = ', '.join(f'"{table.name}"' for table in Base.metadata.sorted_tables)
+
+        async with engine.begin() as connection:
+            await connection.execute(text(f'TRUNCATE {tables} RESTART IDENTITY CASCADE'))
+
+    for name, statement in STEPS:
+        started = time.perf_counter()
+
+        async with engine.begin() as connection:
+            await connection.execute(text(statement), params)
+
+        print(f'{name:<28} {time.perf_counter() - started:8.2f}s', file=sys.stderr)
+
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fill the configured database with generated benchmark data.')
+    parser.add_argument('--ingredients', type=int, default=2000)
+    parser.add_argument('--positions', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--current', type=int, default=300, help='number of not issued orders')
+    parser.add_argument('--reset', action='store_true', help='truncate every table before generating')
+
+    asyncio.run(generate(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
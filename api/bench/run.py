@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, NamedTuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+import httpx  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+from db.engine import SessionManager  # noqa: E402
+from db.models import Ingredient, Order, OrderStatus, Position, StockMovement  # noqa: E402
+from main import app  # noqa: E402
+from metrics import RequestStats, request_stats, track_statements  # noqa: E402
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    build: Callable[[dict[str, Any], int], tuple[str, dict[str, Any]]]
+
+
+def pick(items: list, i: int):
+    return items[i % len(items)] if items else 0
+
+
+def new_position(state: dict[str, Any], i: int) -> tuple[str, dict[str, Any]]:
+    ingredients = {pick(state['ingredients'], i * 7 + k): 1 + k % 3 for k in range(4)}
+
+    return '/position/', {'json': {
+        'name': f'bench-position-{state["run"]}-{i}',
+        'cost': 100,
+        'is_changable': False,
+        'ingredients_id': [{'id': id, 'count': count} for id, count in ingredients.items()],
+    }}
+
+
+def new_order(state: dict[str, Any], i: int) -> tuple[str, dict[str, Any]]:
+    positions = {pick(state['positions'], i * 13 + k): 1 + k % 2 for k in range(1 + i % 3)}
+
+    return f'/order/?table_id={1 + i % 40}', {'json': [{'id': id, 'count': count} for id, count in positions.items()]}
+
+
+def delete_position(state: dict[str, Any], i: int) -> tuple[str, dict[str, Any]]:
+    created = state['created_positions']
+    return f'/position/{created.pop() if created else 0}', {}
+
+
+# reads first, then writes, deletions last so they only remove what the run itself created
+SCENARIOS = (
+    Scenario('GET /ingredient/all', 'GET', lambda state, i: ('/ingredient/all', {})),
+    Scenario('GET /ingredient/{id}/movements', 'GET', lambda state, i: (
+        f'/ingredient/{pick(state["ingredients"], i)}/movements', {}
+    )),
+    Scenario('GET /ingredient/{id}/movements (older page)', 'GET', lambda state, i: (
+        f'/ingredient/{pick(state["ingredients"], i)}/movements', {'params': {'cursor': state['movements_cursor']}}
+    )),
+    Scenario('GET /position/all', 'GET', lambda state, i: ('/position/all', {})),
+    Scenario('GET /position/all (etag)', 'GET', lambda state, i: (
+        '/position/all', {'headers': {'If-None-Match': state['menu_etag']}}
+    )),
+    Scenario('GET /position/all/availability', 'GET', lambda state, i: ('/position/all/availability', {})),
+    Scenario('GET /position/availability/{id}', 'GET', lambda state, i: (
+        f'/position/availability/{pick(state["positions"], i)}', {}
+    )),
+    Scenario('POST /position/availability (cart of 5)', 'POST', lambda state, i: (
+        '/position/availability', {'json': [
+            {'id': pick(state['positions'], i * 5 + k), 'count': 1 + k % 3} for k in range(5)
+        ]}
+    )),
+    Scenario('GET /order/all', 'GET', lambda state, i: ('/order/all', {})),
+    Scenario('GET /order/all (filtered)', 'GET', lambda state, i: (
+        '/order/all', {'params': {'table_id': 1 + i % 40, 'status': 'ISSUED', 'limit': 50}}
+    )),
+    Scenario('GET /order/all (1000)', 'GET', lambda state, i: ('/order/all', {'params': {'limit': 1000}})),
+    Scenario('GET /order/all/current', 'GET', lambda state, i: ('/order/all/current', {})),
+    Scenario('GET /order/export', 'GET', lambda state, i: (
+        '/order/export', {'params': {'format': 'ndjson', 'created_from': state['export_from']}}
+    )),
+    Scenario('GET /analytics/sales', 'GET', lambda state, i: (
+        '/analytics/sales', {'params': {'date_from': state['analytics_from'], 'date_to': state['analytics_to']}}
+    )),
+    Scenario('GET /analytics/sales (hourly)', 'GET', lambda state, i: (
+        '/analytics/sales', {'params': {
+            'date_from': state['export_from'], 'date_to': state['analytics_to'], 'granularity': 'hour',
+            'position_id': pick(state['positions'], i),
+        }}
+    )),
+    Scenario('GET /analytics/positions/top', 'GET', lambda state, i: (
+        '/analytics/positions/top', {'params': {'date_from': state['analytics_from'], 'date_to': state['analytics_to']}}
+    )),
+    Scenario('GET /analytics/kitchen (hour of day)', 'GET', lambda state, i: (
+        '/analytics/kitchen', {'params': {
+            'date_from': state['analytics_from'], 'date_to': state['analytics_to'], 'granularity': 'hour_of_day',
+        }}
+    )),
+    Scenario('POST /ingredient/', 'POST', lambda state, i: (
+        '/ingredient/', {'json': {'name': f'bench-ingredient-{state["run"]}-{i}', 'available': 1000}}
+    )),
+    Scenario('PATCH /ingredient/{id}', 'PATCH', lambda state, i: (
+        f'/ingredient/{pick(state["ingredients"], i)}', {'json': {'available': 500000 + i}}
+    )),
+    Scenario('PUT /ingredient/bulk', 'PUT', lambda state, i: (
+        '/ingredient/bulk', {'json': [
+            {'name': f'ingredient-{pick(state["ingredients"], i * 5 + k)}', 'available': 500000 + k} for k in range(5)
+        ]}
+    )),
+    Scenario('PATCH /ingredient/stock', 'PATCH', lambda state, i: (
+        '/ingredient/stock', {'json': [
+            {'id': pick(state['ingredients'], i * 5 + k), 'delta': 10} for k in range(5)
+        ]}
+    )),
+    Scenario('PATCH /ingredient/stock (one hot ingredient)', 'PATCH', lambda state, i: (
+        '/ingredient/stock', {'json': [{'id': state['ingredients'][0], 'delta': 1, 'reason': 'DELIVERY'}]}
+    )),
+    Scenario('POST /position/', 'POST', new_position),
+    Scenario('PATCH /position/{id}', 'PATCH', lambda state, i: (
+        f'/position/{pick(state["positions"], i)}', {'json': {'cost': 100 + i % 50}}
+    )),
+    Scenario('PUT /position/{id}/ingredients', 'PUT', lambda state, i: (
+        f'/position/{pick(state["created_positions"], i)}/ingredients', {'json': [
+            {'id': pick(state['ingredients'], i * 3 + k), 'count': 1 + k} for k in range(3)
+        ]}
+    )),
+    Scenario('POST /order/', 'POST', new_order),
+    Scenario('PATCH /order/{id}', 'PATCH', lambda state, i: (
+        f'/order/{pick(state["current_orders"], i)}', {'json': {'status': ('PROGRESS', 'READY')[i % 2]}}
+    )),
+    Scenario('DELETE /position/{id}', 'DELETE', delete_position),
+    # handler has no id parameter, kept to track the route once it is fixed
+    Scenario('DELETE /ingredient/{id}', 'DELETE', lambda state, i: (f'/ingredient/{pick(state["ingredients"], i)}', {})),
+)
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+async def load_state(client: httpx.AsyncClient) -> dict[str, Any]:
+    async with SessionManager().get_session() as session:
+        ingredients = (await session.scalars(select(Ingredient.id).order_by(Ingredient.id))).all()
+        positions = (await session.scalars(select(Position.id).order_by(Position.id))).all()
+        current_orders = (await session.scalars(
+            select(Order.id).where(Order.status != OrderStatus.ISSUED).order_by(Order.id).limit(1000)
+        )).all()
+        orders, last_order = (await session.execute(select(func.count(), func.max(Order.created_at)))).one()
+        last_movement = await session.scalar(select(func.max(StockMovement.id)))
+
+    if not positions or not ingredients:
+        raise SystemExit('database is empty, run bench/generate.py first')
+
+    response = await client.get('/position/all')
+
+    return {
+        'run': int(time.time()),
+        'orders': orders,
+        'ingredients': list(ingredients),
+        'positions': list(positions),
+        'current_orders': list(current_orders),
+        'created_positions': [],
+        'menu_etag': response.headers.get('etag', ''),
+        # halfway through the ledger
+        'movements_cursor': (last_movement or 0) // 2,
+        # roughly the last day of history
+        'export_from': ((last_order or datetime.datetime.now()) - datetime.timedelta(days=1)).isoformat(),
+        'analytics_from': ((last_order or datetime.datetime.now()) - datetime.timedelta(days=365)).isoformat(),
+        'analytics_to': ((last_order or datetime.datetime.now()) + datetime.timedelta(days=1)).isoformat(),
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Scenario, state: dict[str, Any], requests: int, concurrency: int, warmup: int
+) -> dict[str, Any]:
+    latencies: list[float] = []
+    counts: list[int] = []
+    statuses: Counter[int] = Counter()
+    sequence = iter(range(warmup + requests))
+
+    async def worker() -> None:
+        for i in sequence:
+            url, kwargs = scenario.build(state, i)
+            # every worker is its own task, so statements are counted per request
+            stats = RequestStats()
+            request_stats.set(stats)
+
+            started = time.perf_counter()
+            response = await client.request(scenario.method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+
+            if scenario.name == 'POST /position/' and response.status_code == 200:
+                state['created_positions'].append(response.json()['id'])
+
+            if i < warmup:
+                continue
+
+            latencies.append(elapsed * 1000)
+            counts.append(stats.statements)
+            statuses[response.status_code] += 1
+
+    started, cpu_started = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(asyncio.create_task(worker()) for _ in range(concurrency)))
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+
+    return {
+        'method': scenario.method,
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        # whole process, so it covers the app and the driver; warmup requests are included
+        'cpu_ms': round(cpu / (warmup + requests) * 1000, 3),
+        'sql_mean': round(statistics.fmean(counts), 2),
+        'sql_max': max(counts),
+    }
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes: dict[str, dict[str, Any]]) -> None:
+    print(f'{"route":<36} {"n":>6} {"err":>5} {"p50":>9} {"p95":>9} {"p99":>9} {"rps":>8} {"cpu":>8} {"sql":>6}')
+
+    for name, result in routes.items():
+        print(
+            f'{name:<36} {result["requests"]:>6} {result["errors"]:>5} {result["p50_ms"]:>9.2f} '
+            f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["rps"]:>8.1f} {result["cpu_ms"]:>8.2f} '
+            f'{result["sql_mean"]:>6.1f}'
+        )
+
+
+async def run(args: argparse.Namespace) -> None:
+    engine = SessionManager().async_engine
+
+    # the app only counts statements with DEBUG or METRICS on
+    for tracked in (engine, SessionManager().replica_engine):
+        if tracked is not None:
+            track_statements(tracked)
+
+    scenarios = [scenario for scenario in SCENARIOS if not args.routes or any(
+        route in scenario.name for route in args.routes
+    )]
+    routes: dict[str, dict[str, Any]] = {}
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        state = await load_state(client)
+
+        for scenario in scenarios:
+            routes[scenario.name] = result = await run_scenario(
+                client, scenario, state, args.requests, args.concurrency, args.warmup
+            )
+            print(f'{scenario.name:<36} p95 {result["p95_ms"]:.2f}ms', file=sys.stderr)
+
+    await engine.dispose()
+
+    print_report(routes)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'meta': {
+                    'revision': get_revision(),
+                    'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'python': platform.python_version(),
+                    'requests': args.requests,
+                    'concurrency': args.concurrency,
+                    'warmup': args.warmup,
+                    'orders': state['orders'],
+                    'ingredients': len(state['ingredients']),
+                    'positions': len(state['positions']),
+                },
+                'routes': routes,
+            }, file, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Drive every API route in-process and report latency and SQL usage.')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per route')
+    parser.add_argument('--routes', nargs='*', help='only run routes containing any of these substrings')
+    parser.add_argument('--output', help='write machine-readable results to this json file')
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
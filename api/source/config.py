@@ -18,6 +18,42 @@ class Settings(BaseSettings):
     POSTGRES_PORT: int
 
     SQLALCHEMY_URL: str | None = None
+    SQLALCHEMY_REPLICA_URL: str | None = None
+
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
+    MENU_CACHE_SIZE: int = 64
+    MENU_CACHE_TTL: float = 300
+
+    IDEMPOTENCY_KEY_TTL: float = 24 * 3600
+
+    # ISSUED orders older than this many seconds are moved to the history tables, unset keeps them all live
+    ORDER_ARCHIVE_AGE: float | None = None
+    ORDER_ARCHIVE_INTERVAL: float = 60
+    ORDER_ARCHIVE_BATCH: int = 1000
+
+    # restocks are only appended to the stock ledger and folded into ingredient.available every this many seconds,
+    # so they don't queue on the stock row locks of orders; unset applies every stock change right away
+    STOCK_FOLD_INTERVAL: float | None = None
+    STOCK_FOLD_BATCH: int = 1000
+
+    # concurrent POST /order requests arriving within the window share one transaction
+    ORDER_BATCH: bool = False
+    ORDER_BATCH_WINDOW: float = 0.005
+    ORDER_BATCH_SIZE: int = 64
+
+    # day boundaries of the sales rollups, existing rollups are not rebucketed when it changes
+    ANALYTICS_TIMEZONE: str = 'UTC'
+
+    METRICS: bool = False
+
+    SQL_STATEMENT_BUDGET: int = 10
+    SQL_REPEATED_STATEMENTS: int = 3
 
     @field_validator('POSTGRES_HOST')
     @classmethod
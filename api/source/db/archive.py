@@ -0,0 +1,48 @@
+import datetime
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import Order, OrderHistory, OrderStatus, Position_xref_Order, Position_xref_OrderHistory
+from db.periodic import PeriodicBatch
+
+
+# live table, history table and the order id column, parents first
+ARCHIVED_TABLES = (
+    (Order, OrderHistory, Order.id),
+    (Position_xref_Order, Position_xref_OrderHistory, Position_xref_Order.order_id),
+)
+
+
+# moves ISSUED orders older than `age` seconds and their lines to the history tables, `batch_size` orders
+# per transaction; workers running it side by side skip each other's locked orders
+class OrderArchiver(PeriodicBatch):
+    def __init__(self, age: float, interval: float, batch_size: int):
+        super().__init__(self.archive_batch, interval, batch_size)
+        self.age = age
+
+    async def archive_batch(self, session: AsyncSession) -> int:
+        cutoff = func.now() - datetime.timedelta(seconds=self.age)
+
+        query = select(Order.id).where(
+            Order.status == OrderStatus.ISSUED,
+            Order.created_at < cutoff,
+            func.coalesce(Order.issued_at, Order.updated_at) < cutoff,
+        )
+        query = query.order_by(Order.created_at, Order.id).limit(self.batch_size).with_for_update(skip_locked=True)
+
+        ids = (await session.scalars(query)).all()
+
+        if not ids:
+            return 0
+
+        for source, target, order_id in ARCHIVED_TABLES:
+            columns = source.__table__.columns
+            query = insert(target).from_select([column.name for column in columns], select(columns).where(order_id.in_(ids)))
+
+            await session.execute(query)
+
+        for source, _, order_id in reversed(ARCHIVED_TABLES):
+            await session.execute(delete(source).where(order_id.in_(ids)))
+
+        return len(ids)
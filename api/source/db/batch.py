@@ -0,0 +1,70 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, TypeVar
+
+
+Item = TypeVar('Item')
+Result = TypeVar('Result')
+
+
+# collects concurrent submits for up to `window` seconds, or until `max_size` are waiting, and passes them to the
+# handler as one batch; the handler returns a result or an exception for every item, in the same order
+class MicroBatcher(Generic[Item, Result]):
+    def __init__(
+        self,
+        handler: Callable[[list[Item]], Awaitable[list[Result | Exception]]],
+        window: float,
+        max_size: int
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_size = max_size
+
+        self.pending: list[tuple[Item, asyncio.Future[Result]]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        self.running: set[asyncio.Task] = set()
+
+    async def submit(self, item: Item) -> Result:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, []
+
+        if not batch:
+            return
+
+        task = asyncio.create_task(self.run(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def run(self, batch: list[tuple[Item, asyncio.Future[Result]]]) -> None:
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as exc:
+            results = [exc] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            # the caller is gone, e.g. the client disconnected
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def stop(self) -> None:
+        self.flush()
+        await asyncio.gather(*self.running, return_exceptions=True)
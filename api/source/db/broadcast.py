@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import ARRAY, Text, bindparam, func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from typing_extensions import AsyncGenerator
+
+from db.engine import SessionManager
+
+
+logger = logging.getLogger(__name__)
+
+
+async def notify(session: AsyncSession, channel: str, *payloads: dict[str, Any]) -> None:
+    # delivered by postgres only when the surrounding transaction commits
+    if len(payloads) == 1:
+        await session.execute(select(func.pg_notify(channel, json.dumps(payloads[0]))))
+        return
+
+    messages = func.unnest(
+        bindparam('payloads', [json.dumps(payload) for payload in payloads], type_=ARRAY(Text))
+    ).table_valued('payload').render_derived()
+
+    await session.execute(select(func.pg_notify(channel, messages.c.payload)))
+
+
+# one LISTEN connection per worker, every payload is loaded once and fanned out to all local subscribers;
+# subscribers that fall behind are dropped with None, so they can reconnect and resync
+class Broadcaster:
+    def __init__(self, channel: str, loader: Callable[[str], Awaitable[str]], queue_size: int = 256):
+        self.channel = channel
+        self.loader = loader
+        self.queue_size = queue_size
+
+        self.subscribers: set[asyncio.Queue[str | None]] = set()
+        self.payloads: asyncio.Queue[str] = asyncio.Queue()
+        self.connection: AsyncConnection | None = None
+        self.dispatcher: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with self.lock:
+            if self.connection is not None:
+                return
+
+            self.connection = await SessionManager().async_engine.connect()
+            driver_connection = (await self.connection.get_raw_connection()).driver_connection
+
+            await driver_connection.add_listener(self.channel, self.on_notify)
+            driver_connection.add_termination_listener(self.on_termination)
+
+            self.dispatcher = asyncio.create_task(self.dispatch())
+
+    async def stop(self) -> None:
+        async with self.lock:
+            if self.dispatcher is not None:
+                self.dispatcher.cancel()
+                self.dispatcher = None
+
+            if self.connection is not None:
+                # listener stays attached to the driver connection, so it must not go back to the pool
+                await self.connection.invalidate()
+                await self.connection.close()
+                self.connection = None
+
+            self.drop_all()
+
+    def on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        self.payloads.put_nowait(payload)
+
+    def on_termination(self, connection) -> None:
+        logger.warning('%s listener connection lost', self.channel)
+        asyncio.create_task(self.stop())
+
+    async def dispatch(self) -> None:
+        while True:
+            payload = await self.payloads.get()
+
+            try:
+                message = await self.loader(payload)
+            except Exception:
+                logger.exception('failed to load %s event %s', self.channel, payload)
+                continue
+
+            for queue in tuple(self.subscribers):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    self.drop(queue)
+
+    def drop(self, queue: asyncio.Queue[str | None]) -> None:
+        self.subscribers.discard(queue)
+
+        while not queue.empty():
+            queue.get_nowait()
+
+        queue.put_nowait(None)
+
+    def drop_all(self) -> None:
+        for queue in tuple(self.subscribers):
+            self.drop(queue)
+
+    @asynccontextmanager
+    async def subscribe(self) -> AsyncGenerator[asyncio.Queue[str | None], None]:
+        await self.start()
+
+        queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+
+        try:
+            yield queue
+        finally:
+            self.subscribers.discard(queue)
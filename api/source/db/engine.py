@@ -1,28 +1,73 @@
+import orjson
+from fastapi import Request
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from typing_extensions import AsyncGenerator
 
 from config import get_settings
+from metrics import get_pool_class, instrument_pool, track_statements
 import sqlalchemy as sql
 
 
 class SessionManager:
     def __init__(self):
+        if hasattr(self, 'async_engine'):
+            return
+
         settings = get_settings()
-        self.async_engine = create_async_engine(
-            url=settings.SQLALCHEMY_URL,
-            echo=False,
-            pool_size=5,
-            max_overflow=10
-        )
-        
+
+        self.async_engine = self.create_engine('primary', settings.SQLALCHEMY_URL)
         self.async_session = sessionmaker(
             self.async_engine,
             expire_on_commit=False,
             class_=AsyncSession
         )
 
+        self.replica_engine: AsyncEngine | None = None
+        self.replica_session: sessionmaker | None = None
+
+        if settings.SQLALCHEMY_REPLICA_URL is not None:
+            # every transaction on the replica is started READ ONLY, so a misrouted write fails loudly
+            self.replica_engine = self.create_engine(
+                'replica', settings.SQLALCHEMY_REPLICA_URL, execution_options={'postgresql_readonly': True}
+            )
+            self.replica_session = sessionmaker(
+                self.replica_engine,
+                expire_on_commit=False,
+                class_=AsyncSession
+            )
+
+    @staticmethod
+    def create_engine(name: str, url: str, **kwargs) -> AsyncEngine:
+        settings = get_settings()
+
+        if settings.METRICS:
+            kwargs['poolclass'] = get_pool_class(name)
+
+        engine = create_async_engine(
+            url=url,
+            echo=False,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            # prepared statements kept per connection by the asyncpg dialect, 0 disables the cache
+            connect_args={'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE},
+            json_deserializer=orjson.loads,
+            **kwargs
+        )
+
+        # per-request statement counts for the query budget and the metrics, see metrics.py
+        if settings.DEBUG or settings.METRICS:
+            track_statements(engine)
+
+        if settings.METRICS:
+            instrument_pool(name, engine, max_overflow=settings.DB_MAX_OVERFLOW)
+
+        return engine
+
     def __new__(cls):
         if not hasattr(cls, 'instance'):
             cls.instance = super().__new__(cls)
@@ -31,6 +76,12 @@ class SessionManager:
     def get_session(self) -> Session | AsyncSession:
         return self.async_session()
 
+    def get_read_session(self) -> Session | AsyncSession:
+        if self.replica_session is None:
+            return self.async_session()
+
+        return self.replica_session()
+
     async def get_all_table_names(self):
         async with self.async_engine.connect() as conn:
             tables = await conn.run_sync(
@@ -52,3 +103,17 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
             raise exc
         finally:
             await async_session.close()
+
+
+# clients send this header on reads that must see their own writes, the replica may lag behind
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+
+async def get_read_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    if READ_PRIMARY_HEADER in request.headers:
+        async_session = SessionManager().get_session()
+    else:
+        async_session = SessionManager().get_read_session()
+
+    async with async_session:
+        yield async_session
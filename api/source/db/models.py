@@ -1,7 +1,9 @@
 import datetime
 import enum
 
-from sqlalchemy import Column, Enum, String, Integer, Boolean, ForeignKey, DateTime, func
+from sqlalchemy import (
+    Column, Enum, Index, String, Integer, Boolean, ForeignKey, DateTime, LargeBinary, UniqueConstraint, func, text
+)
 from sqlalchemy.orm import as_declarative, relationship
 
 
@@ -34,10 +36,49 @@ class Position(Base):
     
 class Position_xref_Ingredient(Base):
     __tablename__ = 'position_xref_ingredient'
+    __table_args__ = (
+        Index('ix_position_xref_ingredient_position_id_makeable', 'position_id', 'makeable'),
+        UniqueConstraint('position_id', 'ingredient_id', name='uq_position_xref_ingredient_position_id_ingredient_id'),
+        {'extend_existing': True},
+    )
 
-    position_id = Column(Integer, ForeignKey('position.id'), index=True, nullable=False)
-    ingredient_id = Column(Integer, ForeignKey('ingredient.id'), nullable=False)
+    position_id = Column(Integer, ForeignKey('position.id'), nullable=False)
+    ingredient_id = Column(Integer, ForeignKey('ingredient.id'), index=True, nullable=False)
     count = Column(Integer, nullable=False)
+    # ingredient.available // count, kept up to date on every stock change
+    makeable = Column(Integer, default=0, nullable=False)
+
+
+class StockMovementReason(str, enum.Enum):
+    DELIVERY = "DELIVERY"
+    CONSUMPTION = "CONSUMPTION"  # taken by an order
+    WASTE = "WASTE"
+    CORRECTION = "CORRECTION"  # stocktaking, absolute stock writes
+
+
+# append-only stock ledger, rows are never changed once written; ingredient.available plus the ingredient's
+# pending_stock rows is the sum of its rows, see routers/ingredient.py
+class StockMovement(Base):
+    __tablename__ = 'stock_movement'
+    __table_args__ = (
+        Index('ix_stock_movement_ingredient_id_id', 'ingredient_id', 'id'),
+        {'extend_existing': True},
+    )
+
+    # no foreign keys, the history outlives deleted ingredients and archived orders
+    ingredient_id = Column(Integer, nullable=False)
+    delta = Column(Integer, nullable=False)
+    reason = Column(Enum(StockMovementReason), nullable=False)
+    order_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+# restocks already in the ledger but not yet added to ingredient.available, the stock folder deletes them as it does
+class PendingStock(Base):
+    __tablename__ = 'pending_stock'
+
+    ingredient_id = Column(Integer, index=True, nullable=False)
+    delta = Column(Integer, nullable=False)
 
 
 class OrderStatus(str, enum.Enum):
@@ -49,9 +90,19 @@ class OrderStatus(str, enum.Enum):
 
 class Order(Base):
     __tablename__ = 'order'
+    __table_args__ = (
+        Index('ix_order_created_at_id', 'created_at', 'id'),
+        Index('ix_order_status_created_at_id', 'status', 'created_at', 'id'),
+        Index('ix_order_table_id_created_at_id', 'table_id', 'created_at', 'id'),
+        # the few not issued orders, issued ones are moved to order_history over time, see db/archive.py
+        Index('ix_order_current_created_at_id', 'created_at', 'id', postgresql_where=text("status <> 'ISSUED'")),
+        {'extend_existing': True},
+    )
 
     table_id = Column(Integer, nullable=False)
     status = Column(Enum(OrderStatus), default=OrderStatus.ACCEPTED, nullable=False)
+    # sum of price * count of the lines, fixed when the order is created
+    cost = Column(Integer, default=0, server_default='0', nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(
         DateTime(timezone=True),
@@ -60,6 +111,10 @@ class Order(Base):
         onupdate=datetime.datetime.now
     )
     ended_at = Column(DateTime(timezone=True), nullable=True)
+    # when the order first reached each status, see routers/analytics.py
+    progress_at = Column(DateTime(timezone=True), nullable=True)
+    ready_at = Column(DateTime(timezone=True), nullable=True)
+    issued_at = Column(DateTime(timezone=True), nullable=True)
 
     positions = relationship('Position', secondary='position_xref_order', back_populates='orders', uselist=True)
 
@@ -70,3 +125,123 @@ class Position_xref_Order(Base):
     order_id = Column(Integer, ForeignKey('order.id'), index=True, nullable=False)
     position_id = Column(Integer, ForeignKey('position.id'), nullable=False)
     count = Column(Integer, nullable=False)
+    # position cost when the order was created
+    price = Column(Integer, nullable=False)
+
+
+# archived ISSUED orders and their lines, same columns as the live tables
+class OrderHistory(Base):
+    __tablename__ = 'order_history'
+    __table_args__ = (
+        Index('ix_order_history_created_at_id', 'created_at', 'id'),
+        Index('ix_order_history_table_id_created_at_id', 'table_id', 'created_at', 'id'),
+        {'extend_existing': True},
+    )
+
+    table_id = Column(Integer, nullable=False)
+    status = Column(Enum(OrderStatus), nullable=False)
+    cost = Column(Integer, default=0, server_default='0', nullable=False)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    progress_at = Column(DateTime(timezone=True), nullable=True)
+    ready_at = Column(DateTime(timezone=True), nullable=True)
+    issued_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class Position_xref_OrderHistory(Base):
+    __tablename__ = 'position_xref_order_history'
+
+    order_id = Column(Integer, ForeignKey('order_history.id'), index=True, nullable=False)
+    # no foreign key, positions can be deleted after their orders were archived
+    position_id = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    price = Column(Integer, nullable=False)
+
+
+# responses of POST /order by the client's Idempotency-Key, see routers/idempotency.py
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        Index('ix_idempotency_key_expires_at', 'expires_at'),
+        {'extend_existing': True},
+    )
+
+    key = Column(String(255), nullable=False, unique=True)
+    fingerprint = Column(String(32), nullable=False)
+    response = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+# rollups of order lines by the hour/day their order was created in, see routers/analytics.py
+class SalesHourly(Base):
+    __tablename__ = 'sales_hourly'
+    __table_args__ = (
+        UniqueConstraint('position_id', 'period', name='uq_sales_hourly_position_id_period'),
+        Index('ix_sales_hourly_period', 'period'),
+        {'extend_existing': True},
+    )
+
+    # no foreign key, the rollups outlive deleted positions
+    position_id = Column(Integer, nullable=False)
+    period = Column(DateTime(timezone=True), nullable=False)
+    units = Column(Integer, default=0, nullable=False)
+    revenue = Column(Integer, default=0, nullable=False)
+    issued_units = Column(Integer, default=0, nullable=False)
+    issued_revenue = Column(Integer, default=0, nullable=False)
+
+
+class SalesDaily(Base):
+    __tablename__ = 'sales_daily'
+    __table_args__ = (
+        UniqueConstraint('position_id', 'period', name='uq_sales_daily_position_id_period'),
+        Index('ix_sales_daily_period', 'period'),
+        {'extend_existing': True},
+    )
+
+    # no foreign key, the rollups outlive deleted positions
+    position_id = Column(Integer, nullable=False)
+    period = Column(DateTime(timezone=True), nullable=False)
+    units = Column(Integer, default=0, nullable=False)
+    revenue = Column(Integer, default=0, nullable=False)
+    issued_units = Column(Integer, default=0, nullable=False)
+    issued_revenue = Column(Integer, default=0, nullable=False)
+
+
+class KitchenStage(str, enum.Enum):
+    PREPARING = "PREPARING"  # ACCEPTED -> READY
+    WAITING = "WAITING"  # READY -> ISSUED
+    TOTAL = "TOTAL"  # ACCEPTED -> ISSUED
+
+
+# histograms of stage durations by the hour their order was created in, see routers/analytics.py
+class KitchenTimeHourly(Base):
+    __tablename__ = 'kitchen_time_hourly'
+    __table_args__ = (
+        UniqueConstraint('period', 'stage', 'bucket', name='uq_kitchen_time_hourly_period_stage_bucket'),
+        {'extend_existing': True},
+    )
+
+    period = Column(DateTime(timezone=True), nullable=False)
+    stage = Column(Enum(KitchenStage), nullable=False)
+    bucket = Column(Integer, nullable=False)
+    orders = Column(Integer, default=0, nullable=False)
+
+
+class PositionKitchenTimeHourly(Base):
+    __tablename__ = 'position_kitchen_time_hourly'
+    __table_args__ = (
+        UniqueConstraint(
+            'position_id', 'period', 'stage', 'bucket', name='uq_position_kitchen_time_hourly_position_id_period_stage_bucket'
+        ),
+        Index('ix_position_kitchen_time_hourly_period', 'period'),
+        {'extend_existing': True},
+    )
+
+    # no foreign key, like the sales rollups
+    position_id = Column(Integer, nullable=False)
+    period = Column(DateTime(timezone=True), nullable=False)
+    stage = Column(Enum(KitchenStage), nullable=False)
+    bucket = Column(Integer, nullable=False)
+    orders = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.engine import SessionManager
+
+
+logger = logging.getLogger(__name__)
+
+
+# background loop shared by the maintenance tasks: runs the handler in its own transaction every `interval` seconds,
+# the handler processes up to `batch_size` rows and returns how many it did
+class PeriodicBatch:
+    def __init__(self, handler: Callable[[AsyncSession], Awaitable[int]], interval: float, batch_size: int):
+        self.handler = handler
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.task: asyncio.Task | None = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with SessionManager().get_session() as session:
+                    done = await self.handler(session)
+                    await session.commit()
+            except Exception:
+                logger.exception('%s batch failed', type(self).__name__)
+                done = 0
+
+            # keeps going while there is a backlog
+            if done < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
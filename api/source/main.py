@@ -1,9 +1,41 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from config import Settings, get_settings
+from db.archive import OrderArchiver
+from metrics import MetricsMiddleware, QueryBudgetMiddleware, router as metrics_router
 
 from routers import __all__ as routers
+from routers.responses import JSONResponse
+from routers.ingredient import stock_folder
+from routers.order import order_batcher, order_board
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    settings = get_settings()
+    archiver: OrderArchiver | None = None
+
+    if settings.ORDER_ARCHIVE_AGE is not None:
+        archiver = OrderArchiver(settings.ORDER_ARCHIVE_AGE, settings.ORDER_ARCHIVE_INTERVAL, settings.ORDER_ARCHIVE_BATCH)
+        archiver.start()
+
+    if stock_folder is not None:
+        stock_folder.start()
+
+    yield
+    await order_board.stop()
+
+    if order_batcher is not None:
+        await order_batcher.stop()
+
+    if archiver is not None:
+        await archiver.stop()
+
+    if stock_folder is not None:
+        await stock_folder.stop()
 
 
 def get_application(settings: Settings):
@@ -11,6 +43,8 @@ def get_application(settings: Settings):
         title='SBS-Test-API',
         version='pre-release',
         debug=settings.DEBUG,
+        lifespan=lifespan,
+        default_response_class=JSONResponse,
     )
 
     application.add_middleware(
@@ -19,11 +53,23 @@ def get_application(settings: Settings):
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", "X-Next-Cursor", "X-SQL-Statements", "Idempotent-Replayed"],
     )
 
     for router in routers:
         application.include_router(router)
 
+    if settings.DEBUG:
+        application.add_middleware(
+            QueryBudgetMiddleware,
+            budget=settings.SQL_STATEMENT_BUDGET,
+            repeated=settings.SQL_REPEATED_STATEMENTS,
+        )
+
+    if settings.METRICS:
+        application.add_middleware(MetricsMiddleware)
+        application.include_router(metrics_router)
+
     return application
 
 
@@ -0,0 +1,254 @@
+import logging
+import re
+import time
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logging.getLogger(__name__)
+
+
+REQUEST_LATENCY = Histogram(
+    'sbs_http_request_duration_seconds', 'Time spent handling a request, response body included',
+    ['method', 'route', 'status'],
+)
+REQUEST_STATEMENTS = Histogram(
+    'sbs_http_request_db_statements', 'SQL statements executed while handling a request',
+    ['method', 'route'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+REQUEST_DB_TIME = Histogram(
+    'sbs_http_request_db_seconds', 'Time spent waiting for SQL statements while handling a request',
+    ['method', 'route'],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'sbs_db_pool_checkout_seconds', 'Time spent getting a connection from the pool, connecting included',
+    ['engine'], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    'sbs_db_pool_checkout_timeouts', 'Pool checkouts that gave up waiting for a connection', ['engine']
+)
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_time: float = 0
+    # statement shape -> executions, only collected when something is going to report them
+    shapes: StatementCounter[str] | None = None
+
+    def repeated(self, times: int = 2) -> list[tuple[str, int]]:
+        if self.shapes is None:
+            return []
+
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= times]
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    engine_name: str
+
+    def _do_get(self):
+        started = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(self.engine_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.engine_name).observe(time.perf_counter() - started)
+
+
+@lru_cache
+def get_pool_class(name: str) -> type[InstrumentedPool]:
+    # the pool is recreated from its class on engine.dispose(), so the label lives on the class
+    return type(f'{name.capitalize()}InstrumentedPool', (InstrumentedPool,), {'engine_name': name})
+
+
+class PoolCollector:
+    def __init__(self):
+        self.engines: dict[str, tuple[AsyncEngine, int]] = {}
+
+    def collect(self):
+        metrics = (
+            ('sbs_db_pool_size', 'Connections kept open by the pool', lambda pool, max_overflow: pool.size()),
+            ('sbs_db_pool_max_overflow', 'Connections allowed above the pool size', lambda pool, max_overflow: max_overflow),
+            ('sbs_db_pool_checked_out', 'Connections currently in use', lambda pool, max_overflow: pool.checkedout()),
+            (
+                'sbs_db_pool_overflow', 'Connections currently open above the pool size',
+                lambda pool, max_overflow: max(pool.overflow(), 0)
+            ),
+        )
+
+        for name, documentation, value in metrics:
+            family = GaugeMetricFamily(name, documentation, labels=['engine'])
+
+            for engine_name, (engine, max_overflow) in self.engines.items():
+                # engine.dispose() replaces the pool, so it is looked up on every scrape
+                family.add_metric([engine_name], value(engine.sync_engine.pool, max_overflow))
+
+            yield family
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+# expanding IN parameters render one placeholder per value, the shape should not depend on how many were passed
+PLACEHOLDERS = re.compile(r'\$\d+(?:::\w+)?(?:, \$\d+(?:::\w+)?)*')
+
+
+def get_statement_shape(statement: str) -> str:
+    return PLACEHOLDERS.sub('?', ' '.join(statement.split()))
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    connection.info['query_started'] = time.perf_counter()
+
+    if (stats := request_stats.get()) is not None:
+        stats.statements += 1
+
+        if stats.shapes is not None:
+            stats.shapes[get_statement_shape(statement)] += 1
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    started = connection.info.pop('query_started', None)
+
+    if started is not None and (stats := request_stats.get()) is not None:
+        stats.db_time += time.perf_counter() - started
+
+
+def track_statements(engine: AsyncEngine) -> None:
+    if event.contains(engine.sync_engine, 'before_cursor_execute', before_cursor_execute):
+        return
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def instrument_pool(name: str, engine: AsyncEngine, max_overflow: int) -> None:
+    pool_collector.engines[name] = (engine, max_overflow)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = request_stats.get() or RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+            await send(message)
+
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(token)
+
+            # the router stores the matched route in the scope, path templates keep label cardinality bounded
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            method = scope['method']
+
+            REQUEST_LATENCY.labels(method, route, status).observe(time.perf_counter() - started)
+            REQUEST_STATEMENTS.labels(method, route).observe(stats.statements)
+            REQUEST_DB_TIME.labels(method, route).observe(stats.db_time)
+
+
+def describe_repeated(stats: RequestStats, times: int) -> str:
+    return ''.join(f'\n  {count}x {shape}' for shape, count in stats.repeated(times))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app: ASGIApp, budget: int, repeated: int):
+        self.app = app
+        self.budget = budget
+        self.repeated = repeated
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = request_stats.get() or RequestStats()
+        stats.shapes = stats.shapes if stats.shapes is not None else StatementCounter()
+        token = request_stats.set(stats)
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                # streamed bodies keep querying after the headers are sent, those statements only reach the log
+                MutableHeaders(scope=message).append('X-SQL-Statements', str(stats.statements))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(token)
+
+            route = f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+
+            if stats.statements > self.budget:
+                logger.warning(
+                    '%s ran %d SQL statements, budget is %d%s',
+                    route, stats.statements, self.budget, describe_repeated(stats, 2)
+                )
+            elif stats.repeated(self.repeated):
+                logger.warning(
+                    '%s repeated SQL statements, possible N+1%s', route, describe_repeated(stats, self.repeated)
+                )
+
+
+@contextmanager
+def assert_statement_budget(budget: int) -> Iterator[RequestStats]:
+    # for tests calling the app in-process, e.g. through httpx.ASGITransport:
+    #     with assert_statement_budget(2):
+    #         await client.get('/order/all')
+    stats = RequestStats(shapes=StatementCounter())
+    token = request_stats.set(stats)
+
+    try:
+        yield stats
+    finally:
+        request_stats.reset(token)
+
+    assert stats.statements <= budget, (
+        f'{stats.statements} SQL statements, budget is {budget}{describe_repeated(stats, 2)}'
+    )
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,5 +1,6 @@
 from routers.ingredient import router as ingredient_router
 from routers.position import router as position_router
 from routers.order import router as order_router
+from routers.analytics import router as analytics_router
 
-__all__ = (ingredient_router, position_router, order_router, )
+__all__ = (ingredient_router, position_router, order_router, analytics_router, )
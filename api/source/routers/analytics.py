@@ -0,0 +1,234 @@
+import datetime
+from itertools import groupby
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import Integer, cast, func, literal, literal_column, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from db.engine import get_read_session
+from db.models import (
+    KitchenStage, KitchenTimeHourly, Order, Position, PositionKitchenTimeHourly, Position_xref_Order, SalesDaily,
+    SalesHourly
+)
+from routers.responses import JSONResponse
+from routers.schemas import KitchenTimes, PositionSales, SalesPeriod
+
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["analytics"],
+)
+
+
+SALES_ROLLUPS = {'hour': SalesHourly, 'day': SalesDaily}
+
+KITCHEN_STAGES = {
+    KitchenStage.PREPARING: (Order.created_at, Order.ready_at),
+    KitchenStage.WAITING: (Order.ready_at, Order.issued_at),
+    KitchenStage.TOTAL: (Order.created_at, Order.issued_at),
+}
+
+# upper bounds in seconds, bucket n holds durations in [KITCHEN_TIME_BUCKETS[n - 1], KITCHEN_TIME_BUCKETS[n]),
+# the last one everything longer; changing them needs a migration rebucketing the stored histograms
+KITCHEN_TIME_BUCKETS = (60, 120, 180, 240, 300, 420, 600, 900, 1200, 1500, 1800, 2700, 3600, 5400, 7200, 10800)
+KITCHEN_TIME_THRESHOLDS = literal_column(f"ARRAY[{', '.join(map(str, KITCHEN_TIME_BUCKETS))}]::numeric[]")
+
+
+async def record_sales(session: AsyncSession, *criteria, issued: bool = False, sign: int = 1) -> None:
+    # adds (or with sign=-1 takes back) the lines of the orders matching criteria to every rollup;
+    # rows are upserted in position order, so concurrent orders lock shared rollup rows in the same order
+    timezone = get_settings().ANALYTICS_TIMEZONE
+    columns = ('issued_units', 'issued_revenue') if issued else ('units', 'revenue')
+
+    for granularity, table in SALES_ROLLUPS.items():
+        period = func.date_trunc(granularity, Order.created_at, timezone)
+
+        lines = select(
+            Position_xref_Order.position_id,
+            period,
+            func.sum(Position_xref_Order.count) * sign,
+            func.sum(Position_xref_Order.count * Position_xref_Order.price) * sign,
+        )
+        lines = lines.join(Order, Position_xref_Order.order_id == Order.id)
+        lines = lines.where(*criteria).group_by(Position_xref_Order.position_id, period)
+        lines = lines.order_by(Position_xref_Order.position_id, period)
+
+        query = insert(table).from_select(['position_id', 'period', *columns], lines)
+        query = query.on_conflict_do_update(
+            index_elements=[table.position_id, table.period],
+            set_={column: getattr(table, column) + getattr(query.excluded, column) for column in columns}
+        )
+
+        await session.execute(query)
+
+
+async def record_kitchen_times(session: AsyncSession, order_id: int, reached: str) -> None:
+    # counts the order in the histograms of every stage ending with its status time column `reached`,
+    # rows are upserted in (position, stage) order like the sales rollups
+    period = func.date_trunc('hour', Order.created_at, get_settings().ANALYTICS_TIMEZONE)
+    stages = [stage for stage, (_, end) in KITCHEN_STAGES.items() if end.key == reached]
+
+    if not stages:
+        return
+
+    for table in (KitchenTimeHourly, PositionKitchenTimeHourly):
+        by_position = table is PositionKitchenTimeHourly
+        durations = []
+
+        for stage in stages:
+            start, end = KITCHEN_STAGES[stage]
+            bucket = func.width_bucket(func.extract('epoch', end - start), KITCHEN_TIME_THRESHOLDS)
+
+            columns = [period.label('period'), literal(stage, table.stage.type).label('stage'), bucket.label('bucket')]
+            query = select(*columns).where(Order.id == order_id, start.is_not(None), end.is_not(None))
+
+            if by_position:
+                query = query.add_columns(Position_xref_Order.position_id).distinct()
+                query = query.join(Position_xref_Order, Position_xref_Order.order_id == Order.id)
+
+            durations.append(query)
+
+        durations = union_all(*durations).subquery()
+        order = (durations.c.position_id, durations.c.stage) if by_position else (durations.c.stage,)
+        names = ['period', 'stage', 'bucket', *(['position_id'] if by_position else [])]
+
+        query = insert(table).from_select(
+            [*names, 'orders'], select(*(durations.c[name] for name in names), literal(1)).order_by(*order)
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[getattr(table, name) for name in ('position_id', 'period', 'stage', 'bucket') if name in names],
+            set_={'orders': table.orders + query.excluded.orders}
+        )
+
+        await session.execute(query)
+
+
+def get_percentile(buckets: list[tuple[int, int]], total: int, percentile: float) -> float:
+    # linear within the bucket holding the rank, the open ended last bucket reports its lower bound
+    rank = total * percentile
+    seen = 0
+
+    for bucket, orders in buckets:
+        if seen + orders >= rank:
+            lower = KITCHEN_TIME_BUCKETS[bucket - 1] if bucket > 0 else 0
+
+            if bucket >= len(KITCHEN_TIME_BUCKETS):
+                return float(lower)
+
+            return lower + (KITCHEN_TIME_BUCKETS[bucket] - lower) * (rank - seen) / orders
+
+        seen += orders
+
+    return float(KITCHEN_TIME_BUCKETS[-1])
+
+
+def get_sales_totals(table):
+    return (
+        func.sum(table.units).label('units'),
+        func.sum(table.revenue).label('revenue'),
+        func.sum(table.issued_units).label('issued_units'),
+        func.sum(table.issued_revenue).label('issued_revenue'),
+    )
+
+
+@router.get('/sales', response_model=list[SalesPeriod])
+async def get_sales(
+    date_from: datetime.datetime,
+    date_to: datetime.datetime,
+    granularity: Literal['hour', 'day'] = 'day',
+    position_id: int | None = None,
+    by_position: bool = False,
+    session: AsyncSession = Depends(get_read_session)
+):
+    table = SALES_ROLLUPS[granularity]
+    groups = (table.period, table.position_id) if by_position else (table.period,)
+
+    query = select(*groups, *get_sales_totals(table))
+    query = query.where(table.period >= date_from, table.period < date_to)
+
+    if position_id is not None:
+        query = query.where(table.position_id == position_id)
+
+    query = query.group_by(*groups).order_by(*groups)
+
+    return JSONResponse([row._asdict() for row in (await session.execute(query)).all()])
+
+
+@router.get('/positions/top', response_model=list[PositionSales])
+async def get_top_positions(
+    date_from: datetime.datetime,
+    date_to: datetime.datetime,
+    granularity: Literal['hour', 'day'] = 'day',
+    order_by: Literal['revenue', 'units'] = 'revenue',
+    limit: int = Query(10, ge=1, le=100),
+    session: AsyncSession = Depends(get_read_session)
+):
+    table = SALES_ROLLUPS[granularity]
+    totals = {total.name: total for total in get_sales_totals(table)}
+
+    sales = select(table.position_id, *totals.values())
+    sales = sales.where(table.period >= date_from, table.period < date_to).group_by(table.position_id)
+    sales = sales.order_by(totals[order_by].desc(), table.position_id).limit(limit).subquery()
+
+    # deleted positions keep their sales, without a name
+    query = select(sales.c.position_id.label('id'), Position.name, *(sales.c[name] for name in totals))
+    query = query.outerjoin(Position, sales.c.position_id == Position.id)
+    query = query.order_by(sales.c[order_by].desc(), sales.c.position_id)
+
+    return JSONResponse([row._asdict() for row in (await session.execute(query)).all()])
+
+
+@router.get('/kitchen', response_model=list[KitchenTimes])
+async def get_kitchen_times(
+    date_from: datetime.datetime,
+    date_to: datetime.datetime,
+    stage: KitchenStage | None = None,
+    granularity: Literal['total', 'hour', 'day', 'hour_of_day'] = 'total',
+    position_id: int | None = None,
+    by_position: bool = False,
+    session: AsyncSession = Depends(get_read_session)
+):
+    timezone = get_settings().ANALYTICS_TIMEZONE
+    table = PositionKitchenTimeHourly if by_position or position_id is not None else KitchenTimeHourly
+
+    groups = [table.stage]
+
+    if granularity == 'hour':
+        groups.append(table.period)
+    elif granularity == 'day':
+        groups.append(func.date_trunc('day', table.period, timezone).label('period'))
+    elif granularity == 'hour_of_day':
+        groups.append(cast(func.extract('hour', func.timezone(timezone, table.period)), Integer).label('hour'))
+
+    if by_position:
+        groups.append(table.position_id)
+
+    query = select(*groups, table.bucket, func.sum(table.orders).label('orders'))
+    query = query.where(table.period >= date_from, table.period < date_to)
+
+    if stage is not None:
+        query = query.where(table.stage == stage)
+
+    if position_id is not None:
+        query = query.where(table.position_id == position_id)
+
+    query = query.group_by(*groups, table.bucket).order_by(*groups, table.bucket)
+
+    result = []
+
+    for key, rows in groupby((await session.execute(query)).all(), key=lambda row: row[:len(groups)]):
+        buckets = [(row.bucket, row.orders) for row in rows]
+        total = sum(orders for _, orders in buckets)
+
+        result.append({
+            **dict(zip((group.key for group in groups), key)),
+            'orders': total,
+            'p50': get_percentile(buckets, total, 0.5),
+            'p90': get_percentile(buckets, total, 0.9),
+            'p99': get_percentile(buckets, total, 0.99),
+        })
+
+    return JSONResponse(result)
@@ -0,0 +1,82 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from fastapi import Request, Response
+
+from config import get_settings
+
+
+class CachedResponse(NamedTuple):
+    content: bytes
+    etag: str
+    expires_at: float
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        # bumped by every invalidate, so a response read before a write committed isn't cached after it
+        self.generation = 0
+
+    def get(self, key: str) -> CachedResponse | None:
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, content: bytes, generation: int) -> CachedResponse:
+        # `generation` is the one the caller read before querying, a stale entry is returned but not stored
+        entry = CachedResponse(
+            content=content,
+            etag=f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+            expires_at=time.monotonic() + self.ttl,
+        )
+
+        if generation != self.generation:
+            return entry
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return entry
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+
+    if header is None:
+        return False
+
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return '*' in tags or etag in tags
+
+
+def cached_response(request: Request, entry: CachedResponse) -> Response:
+    headers = {'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=entry.content, media_type='application/json', headers=headers)
+
+
+settings = get_settings()
+menu_cache = ResponseCache(maxsize=settings.MENU_CACHE_SIZE, ttl=settings.MENU_CACHE_TTL)
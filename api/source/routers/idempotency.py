@@ -0,0 +1,78 @@
+import datetime
+import hashlib
+import time
+from typing import Any
+
+from fastapi import HTTPException, Response
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from db.models import IdempotencyKey
+from routers.responses import dump_json
+
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def get_request_fingerprint(*parts: Any) -> str:
+    return hashlib.blake2b(dump_json(parts), digest_size=16).hexdigest()
+
+
+class IdempotencyKeys:
+    def __init__(self, ttl: float, purge_interval: float = 60, purge_batch: int = 1000):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self.next_purge = 0.0
+
+    async def claim(self, session: AsyncSession, key: str, fingerprint: str) -> bytes | None:
+        # a concurrent request with the same key waits on the unique index until the first one commits or rolls back;
+        # returns the stored response of a finished request, None when this request owns the key
+        await self.purge(session)
+
+        query = insert(IdempotencyKey).values(
+            key=key,
+            fingerprint=fingerprint,
+            expires_at=func.now() + datetime.timedelta(seconds=self.ttl),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[IdempotencyKey.key],
+            set_={'fingerprint': query.excluded.fingerprint, 'expires_at': query.excluded.expires_at, 'response': None},
+            where=IdempotencyKey.expires_at <= func.now(),
+        )
+
+        if await session.scalar(query.returning(IdempotencyKey.id)) is not None:
+            return None
+
+        stored = (await session.execute(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.response).where(IdempotencyKey.key == key)
+        )).one()
+
+        if stored.fingerprint != fingerprint:
+            raise HTTPException(422, 'idempotency key already used for another request')
+
+        return stored.response
+
+    async def store(self, session: AsyncSession, key: str, content: bytes) -> None:
+        # written in the transaction creating the order, so a key is never committed without its response
+        await session.execute(update(IdempotencyKey).where(IdempotencyKey.key == key).values(response=content))
+
+    async def purge(self, session: AsyncSession) -> None:
+        if time.monotonic() < self.next_purge:
+            return
+
+        self.next_purge = time.monotonic() + self.purge_interval
+
+        expired = select(IdempotencyKey.id).where(IdempotencyKey.expires_at <= func.now())
+        expired = expired.limit(self.purge_batch).with_for_update(skip_locked=True)
+
+        await session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired.scalar_subquery())))
+
+
+def replayed_response(content: bytes) -> Response:
+    return Response(content=content, media_type='application/json', headers={REPLAYED_HEADER: 'true'})
+
+
+idempotency_keys = IdempotencyKeys(ttl=get_settings().IDEMPOTENCY_KEY_TTL)
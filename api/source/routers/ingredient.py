@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
+from collections import defaultdict
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import Integer, Row, column, delete, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import Ingredient
-from routers.schemas import IngredientGet, IngredientPatch, IngredientPost
-from db.engine import get_async_session
+from config import get_settings
+from db.models import Ingredient, PendingStock, Position_xref_Ingredient, StockMovement, StockMovementReason
+from routers.cache import menu_cache
+from routers.position import refresh_positions_availability
+from routers.responses import JSONResponse
+from routers.schemas import IngredientGet, IngredientPatch, IngredientPost, IngredientStockDelta, StockMovementGet
+from db.engine import get_async_session, get_read_session
+from db.periodic import PeriodicBatch
 
 
 router = APIRouter(
@@ -13,6 +21,93 @@ router = APIRouter(
 )
 
 
+# restocks still waiting for the stock folder
+PENDING_STOCK = select(func.coalesce(func.sum(PendingStock.delta), 0)).where(
+    PendingStock.ingredient_id == Ingredient.id
+).scalar_subquery()
+STOCK_LEVEL = (Ingredient.available + PENDING_STOCK).label('available')
+
+
+async def lock_stock(session: AsyncSession, *criteria) -> list[Row]:
+    # stock rows are always locked in ingredient id order, so parallel writers can't deadlock
+    query = select(Ingredient.id, Ingredient.name, Ingredient.available, PENDING_STOCK.label('pending'))
+    query = query.where(*criteria).order_by(Ingredient.id).with_for_update(key_share=True)
+
+    return (await session.execute(query)).all()
+
+
+async def change_stock(session: AsyncSession, deltas: dict[int, int]) -> list[Row]:
+    stock = values(column('id', Integer), column('delta', Integer), name='stock').data(sorted(deltas.items()))
+
+    query = update(Ingredient).where(
+        Ingredient.id == stock.c.id,
+        Ingredient.available + stock.c.delta >= 0
+    ).values(available=Ingredient.available + stock.c.delta)
+    query = query.returning(Ingredient.id, Ingredient.name, Ingredient.available)
+
+    changed = (await session.execute(query, execution_options={'synchronize_session': False})).all()
+    await refresh_positions_availability(session, Position_xref_Ingredient.ingredient_id.in_(deltas))
+
+    return changed
+
+
+async def fold_stock(session: AsyncSession, ids: list[int]) -> dict[int, int]:
+    # moves the pending restocks of the ingredients to their stock, the caller holds the stock row locks;
+    # returns the folded delta by ingredient id
+    if not ids:
+        return {}
+
+    folded = delete(PendingStock).where(PendingStock.ingredient_id.in_(ids))
+    folded = folded.returning(PendingStock.ingredient_id, PendingStock.delta).cte('folded')
+
+    totals = select(folded.c.ingredient_id, func.sum(folded.c.delta).label('delta')).group_by(folded.c.ingredient_id)
+    totals = totals.cte('totals')
+
+    query = update(Ingredient).where(Ingredient.id == totals.c.ingredient_id)
+    query = query.values(available=Ingredient.available + totals.c.delta).returning(Ingredient.id, totals.c.delta)
+
+    changed = {
+        ingredient.id: ingredient.delta
+        for ingredient in await session.execute(query, execution_options={'synchronize_session': False})
+    }
+
+    if changed:
+        await refresh_positions_availability(session, Position_xref_Ingredient.ingredient_id.in_(changed))
+
+    return changed
+
+
+async def record_stock_movements(session: AsyncSession, movements: list[dict]) -> None:
+    if movements:
+        await session.execute(insert(StockMovement), movements)
+
+
+# folds the restocks waiting in the ledger into ingredient.available, `batch_size` ingredients per transaction,
+# so a hot ingredient takes one short stock row lock per interval instead of one per restock
+class StockFolder(PeriodicBatch):
+    def __init__(self, interval: float, batch_size: int):
+        super().__init__(self.fold_batch, interval, batch_size)
+
+    async def fold_batch(self, session: AsyncSession) -> int:
+        query = select(PendingStock.ingredient_id).distinct().order_by(PendingStock.ingredient_id)
+        ids = (await session.scalars(query.limit(self.batch_size))).all()
+
+        if not ids:
+            return 0
+
+        await lock_stock(session, Ingredient.id.in_(ids))
+        await fold_stock(session, ids)
+
+        return len(ids)
+
+
+settings = get_settings()
+stock_folder: StockFolder | None = None
+
+if settings.STOCK_FOLD_INTERVAL is not None:
+    stock_folder = StockFolder(settings.STOCK_FOLD_INTERVAL, settings.STOCK_FOLD_BATCH)
+
+
 @router.post('/', response_model=IngredientGet)
 async def add_new_ingredient(data: IngredientPost, session: AsyncSession = Depends(get_async_session)):
     already = await session.scalar(select(Ingredient).where(Ingredient.name == data.name))
@@ -23,6 +118,13 @@ async def add_new_ingredient(data: IngredientPost, session: AsyncSession = Depen
     ingredient = Ingredient(**data.model_dump())
 
     session.add(ingredient)
+    await session.flush()
+
+    if ingredient.available:
+        await record_stock_movements(session, [{
+            'ingredient_id': ingredient.id, 'delta': ingredient.available, 'reason': StockMovementReason.CORRECTION,
+        }])
+
     await session.commit()
     await session.refresh(ingredient)
 
@@ -30,8 +132,139 @@ async def add_new_ingredient(data: IngredientPost, session: AsyncSession = Depen
 
 
 @router.get('/all', response_model=list[IngredientGet])
-async def get_all_ingredients(session: AsyncSession = Depends(get_async_session)):
-    return (await session.scalars(select(Ingredient))).all()
+async def get_all_ingredients(session: AsyncSession = Depends(get_read_session)):
+    # pending restocks summed once for the whole table rather than per ingredient
+    pending = select(PendingStock.ingredient_id, func.sum(PendingStock.delta).label('delta'))
+    pending = pending.group_by(PendingStock.ingredient_id).subquery('pending')
+
+    available = (Ingredient.available + func.coalesce(pending.c.delta, 0)).label('available')
+    query = select(Ingredient.id, Ingredient.name, available)
+    query = query.outerjoin(pending, pending.c.ingredient_id == Ingredient.id)
+
+    ingredients = (await session.execute(query)).all()
+
+    return JSONResponse([ingredient._asdict() for ingredient in ingredients])
+
+
+@router.put('/bulk', response_model=list[IngredientGet])
+async def upsert_ingredients(data: list[IngredientPost], session: AsyncSession = Depends(get_async_session)):
+    ingredients: dict[str, int | None] = {ingredient_data.name: ingredient_data.available for ingredient_data in data}
+
+    if any(available is not None and available < 0 for available in ingredients.values()):
+        raise HTTPException(400, 'wrong new_count value')
+
+    if not ingredients:
+        return []
+
+    # new names first, in name order so concurrent upserts wait on each other's rows in the same order; a name
+    # inserted by a concurrent request meanwhile conflicts and is updated below like any existing row
+    rows = [{'name': name, 'available': available or 0} for name, available in sorted(ingredients.items())]
+    query = insert(Ingredient).values(rows).on_conflict_do_nothing(index_elements=[Ingredient.name])
+    created = (await session.execute(query.returning(Ingredient.id, Ingredient.name, Ingredient.available))).all()
+
+    await record_stock_movements(session, [{
+        'ingredient_id': ingredient.id, 'delta': ingredient.available, 'reason': StockMovementReason.CORRECTION,
+    } for ingredient in created if ingredient.available])
+
+    created_names = {ingredient.name for ingredient in created}
+    existing = {
+        name: available for name, available in ingredients.items()
+        if available is not None and name not in created_names
+    }
+
+    if existing:
+        # the correction is the difference to the locked row, so the ledger keeps summing up to the stock
+        locked = await lock_stock(session, Ingredient.name.in_(existing))
+        folded = await fold_stock(session, [ingredient.id for ingredient in locked if ingredient.pending])
+        deltas = {
+            ingredient.id: existing[ingredient.name] - ingredient.available - folded.get(ingredient.id, 0)
+            for ingredient in locked
+        }
+        deltas = {id: delta for id, delta in deltas.items() if delta}
+
+        if deltas:
+            await change_stock(session, deltas)
+            await record_stock_movements(session, [
+                {'ingredient_id': id, 'delta': delta, 'reason': StockMovementReason.CORRECTION}
+                for id, delta in deltas.items()
+            ])
+
+    # rows sent without stock may have restocks pending
+    query = select(Ingredient.id, Ingredient.name, STOCK_LEVEL).where(Ingredient.name.in_(ingredients))
+    result = (await session.execute(query.order_by(Ingredient.id))).all()
+    await session.commit()
+
+    return result
+
+
+@router.get('/{id}/movements', response_model=list[StockMovementGet])
+async def get_stock_movements(
+    id: int,
+    cursor: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_read_session)
+):
+    # newest first, the cursor is the id of the last movement of the previous page
+    query = select(StockMovement.__table__.columns).where(StockMovement.ingredient_id == id)
+
+    if cursor is not None:
+        query = query.where(StockMovement.id < cursor)
+
+    movements = (await session.execute(query.order_by(StockMovement.id.desc()).limit(limit))).all()
+    headers = {'X-Next-Cursor': str(movements[-1].id)} if len(movements) == limit else None
+
+    return JSONResponse([movement._asdict() for movement in movements], headers=headers)
+
+
+@router.patch('/stock', response_model=list[IngredientGet])
+async def change_ingredients_stock(data: list[IngredientStockDelta], session: AsyncSession = Depends(get_async_session)):
+    deltas: dict[int, int] = defaultdict(int)
+
+    for stock_data in data:
+        deltas[stock_data.id] += stock_data.delta
+
+    if not deltas:
+        return []
+
+    # with a stock folder, restocks can't oversell and only go to the ledger, the stock rows stay unlocked
+    pending = {id for id, delta in deltas.items() if delta >= 0} if stock_folder is not None else set()
+    applied = {id: delta for id, delta in deltas.items() if id not in pending}
+
+    if applied:
+        locked = await lock_stock(session, Ingredient.id.in_(applied))
+        folded = await fold_stock(session, [ingredient.id for ingredient in locked if ingredient.pending])
+        stock = {ingredient.id: ingredient.available + folded.get(ingredient.id, 0) for ingredient in locked}
+
+        for id, delta in applied.items():
+            if id not in stock:
+                raise HTTPException(404, 'wrong ingredient id')
+
+            if stock[id] + delta < 0:
+                raise HTTPException(400, f'not enough ingredient {id}')
+
+        await change_stock(session, applied)
+
+    if pending:
+        found = (await session.scalars(select(Ingredient.id).where(Ingredient.id.in_(pending)))).all()
+
+        if len(found) < len(pending):
+            raise HTTPException(404, 'wrong ingredient id')
+
+    await record_stock_movements(session, [{
+        'ingredient_id': stock_data.id, 'delta': stock_data.delta, 'reason': stock_data.reason,
+    } for stock_data in data if stock_data.delta])
+
+    restocks = [{'ingredient_id': id, 'delta': deltas[id]} for id in sorted(pending) if deltas[id]]
+
+    if restocks:
+        await session.execute(insert(PendingStock), restocks)
+
+    changed = (await session.execute(
+        select(Ingredient.id, Ingredient.name, STOCK_LEVEL).where(Ingredient.id.in_(deltas)).order_by(Ingredient.id)
+    )).all()
+    await session.commit()
+
+    return changed
 
 
 @router.patch('/{id}', response_model=IngredientGet)
@@ -45,16 +278,29 @@ async def change_ingredient_count(id: int, data: IngredientPatch, session: Async
         if data.available < 0:
             raise HTTPException(400, 'wrong new_count value')
 
-        ingredient.available = data.available
+        # applied as a delta to the locked row rather than overwriting the value read above, so it's in the ledger
+        locked = await lock_stock(session, Ingredient.id == id)
+        folded = await fold_stock(session, [id] if locked[0].pending else [])
+        delta = data.available - locked[0].available - folded.get(id, 0)
+
+        if delta:
+            await change_stock(session, {id: delta})
+            await record_stock_movements(session, [
+                {'ingredient_id': id, 'delta': delta, 'reason': StockMovementReason.CORRECTION}
+            ])
 
     if data.name is not None:
         ingredient.name = data.name
 
     session.add(ingredient)
+    # with restocks still pending, ingredient.available alone is behind
+    changed = (await session.execute(
+        select(Ingredient.id, Ingredient.name, STOCK_LEVEL).where(Ingredient.id == id)
+    )).one()
     await session.commit()
-    await session.refresh(ingredient)
+    menu_cache.invalidate()
 
-    return ingredient
+    return changed
 
 
 @router.delete('/{id}')
@@ -1,14 +1,38 @@
+import asyncio
+import base64
+from collections import defaultdict
+import csv
 import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import Row, select
+import io
+import json
+from typing import Callable, Literal, NamedTuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import (
+    JSON, ColumnElement, Row, Select, Subquery, Table, func, insert, lambda_stmt, literal, literal_column, select,
+    tuple_, type_coerce, union_all
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.ext.asyncio import AsyncSession
-
-from db.models import Order, OrderStatus, Position, Position_xref_Order
-from routers.position import get_position_data
+from sqlalchemy.sql.util import ClauseAdapter
+from typing_extensions import AsyncGenerator
+
+from config import get_settings
+from db.batch import MicroBatcher
+from db.broadcast import Broadcaster, notify
+from db.models import (
+    Ingredient, Order, OrderHistory, OrderStatus, Position, Position_xref_Order, Position_xref_OrderHistory,
+    StockMovementReason
+)
+from routers.analytics import record_kitchen_times, record_sales
+from routers.idempotency import get_request_fingerprint, idempotency_keys, replayed_response
+from routers.ingredient import change_stock, fold_stock, lock_stock, record_stock_movements
+from routers.position import get_positions_availability
+from routers.responses import JSONResponse, dump_json
 from routers.schemas import (
-    OrderBase, OrderGet, OrderGetShort, OrderPatch, OrderPosition, PositionFull, PositionId
+    IngredientFull, OrderBase, OrderGet, OrderGetShort, OrderPatch, OrderPosition, PositionFull, PositionId
 )
-from db.engine import get_async_session
+from db.engine import SessionManager, get_async_session, get_read_session
 
 
 router = APIRouter(
@@ -16,125 +40,530 @@ router = APIRouter(
     tags=["order"],
 )
 
+# rendered inline, so generic plans of prepared statements can still use ix_order_current_created_at_id
+IS_CURRENT = Order.status != literal(OrderStatus.ISSUED, Order.status.type, literal_execute=True)
 
-@router.post('/', response_model=OrderGet)
-async def post_order(table_id: int, data: list[OrderPosition], session: AsyncSession = Depends(get_async_session)):
-    positions: list[tuple[Position, int, list[Row]]] = []
-    cost: int = 0
+# in the order an order moves through the statuses
+STATUS_TIMES = {
+    OrderStatus.PROGRESS: 'progress_at',
+    OrderStatus.READY: 'ready_at',
+    OrderStatus.ISSUED: 'issued_at',
+}
+
+
+def get_reached_status_time(order: Order) -> str | None:
+    # only the first time an order reaches a status is kept, and never after it reached a later one,
+    # so every order is counted in each kitchen stage once
+    if order.status not in STATUS_TIMES:
+        return None
+
+    names = list(STATUS_TIMES.values())
+    later = names[names.index(STATUS_TIMES[order.status]):]
+
+    if any(getattr(order, name) is not None for name in later):
+        return None
+
+    return STATUS_TIMES[order.status]
+
+
+class OrderRequest(NamedTuple):
+    table_id: int
+    data: list[OrderPosition]
+
+
+OrderLines = list[tuple[Row, int, list[IngredientFull]]]
+
+
+def get_order_lines(data: list[OrderPosition], positions_data: dict[int, Row]) -> OrderLines:
+    positions: OrderLines = []
 
     for position_data in data:
-        position = await session.get(Position, position_data.id)
+        position = positions_data.get(position_data.id)
 
         if position is None:
             raise HTTPException(400, "wrong position id")
-        
-        ingredients_data = await get_position_data(position.id, session)
-        
-        available_ingredients: list[Row] = []
-        for ingredient_data in ingredients_data:
-            if (ingredient_data.count * position_data.count) > ingredient_data.available:
-                raise HTTPException(400, f"no ingredients for position {position.id}")
 
-            available_ingredients.append(ingredient_data)
+        ingredients_data = sorted(
+            map(IngredientFull.model_validate, (*position.available_ingredients, *position.unavailable_ingredients)),
+            key=lambda ingredient: ingredient.id
+        )
 
         positions.append((position, position_data.count, ingredients_data))
-        cost += position.cost * position_data.count
 
-    order = Order(table_id=table_id)
-    
-    session.add(order)
-    await session.commit()
-    await session.refresh(order)
+    return positions
 
-    for position, count, _ in positions:
-        session.add(Position_xref_Order(
-            order_id=order.id,
-            position_id=position.id,
-            count=count
-        ))
 
-    await session.commit()
+def get_needed_ingredients(positions: OrderLines) -> dict[int, int]:
+    needed: dict[int, int] = defaultdict(int)
+
+    for _, count, ingredients_data in positions:
+        for ingredient_data in ingredients_data:
+            needed[ingredient_data.id] += ingredient_data.count * count
 
-    return OrderGet(
-        cost=cost,
-        positions=map(
-            lambda struct: PositionFull(
-                **PositionId.model_validate(struct[0]).model_dump(),
-                count=struct[1],
-                ingredients=struct[2]
+    return needed
+
+
+async def reserve_ingredients(orders: list[OrderLines], session: AsyncSession) -> list[HTTPException | None]:
+    # the stock of every order is locked at once and handed out in order, an order that doesn't fit fails alone
+    needed = [get_needed_ingredients(positions) for positions in orders]
+    ids = set().union(*needed)
+
+    if not ids:
+        return [None] * len(orders)
+
+    stock: dict[int, Row] = {
+        ingredient.id: ingredient for ingredient in await lock_stock(session, Ingredient.id.in_(ids))
+    }
+    available: dict[int, int] = {id: ingredient.available + ingredient.pending for id, ingredient in stock.items()}
+
+    reserved: dict[int, int] = defaultdict(int)
+    errors: list[HTTPException | None] = []
+
+    for positions, order_needed in zip(orders, needed):
+        error = next((
+            HTTPException(400, f"no ingredients for position {position.id}")
+            for position, _, ingredients_data in positions
+            for ingredient_data in ingredients_data
+            if order_needed[ingredient_data.id] > available.get(ingredient_data.id, 0) - reserved[ingredient_data.id]
+        ), None)
+
+        if error is None:
+            for id, count in order_needed.items():
+                reserved[id] += count
+
+        errors.append(error)
+
+    deltas = {id: -count for id, count in reserved.items() if count}
+
+    # restocks still waiting in the ledger are only folded when an order needs them
+    await fold_stock(session, [id for id in deltas if reserved[id] > stock[id].available])
+
+    if deltas and len(await change_stock(session, deltas)) != len(deltas):
+        raise HTTPException(400, "not enough ingredients for order")
+
+    return errors
+
+
+async def create_orders(session: AsyncSession, requests: list[OrderRequest]) -> list[OrderGet | HTTPException]:
+    positions_data: dict[int, Row] = {
+        position.id: position for position in await get_positions_availability(
+            session, {position_data.id for request in requests for position_data in request.data}
+        )
+    }
+
+    results: list[OrderGet | HTTPException | None] = [None] * len(requests)
+    accepted: list[tuple[int, OrderLines]] = []
+
+    for index, request in enumerate(requests):
+        try:
+            accepted.append((index, get_order_lines(request.data, positions_data)))
+        except HTTPException as exc:
+            results[index] = exc
+
+    errors = await reserve_ingredients([positions for _, positions in accepted], session)
+
+    for (index, _), error in zip(accepted, errors):
+        results[index] = error
+
+    accepted = [(index, positions) for index, positions in accepted if results[index] is None]
+
+    if not accepted:
+        return results
+
+    orders = (await session.scalars(
+        insert(Order).returning(Order, sort_by_parameter_order=True),
+        [{
+            'table_id': requests[index].table_id,
+            'cost': sum(position.cost * count for position, count, _ in positions),
+        } for index, positions in accepted]
+    )).all()
+
+    lines = [{
+        'order_id': order.id,
+        'position_id': position.id,
+        'count': count,
+        'price': position.cost,
+    } for order, (_, positions) in zip(orders, accepted) for position, count, _ in positions]
+
+    if lines:
+        await session.execute(insert(Position_xref_Order), lines)
+        await record_sales(session, Position_xref_Order.order_id.in_([order.id for order in orders]))
+        await record_stock_movements(session, [
+            {'ingredient_id': id, 'delta': -count, 'reason': StockMovementReason.CONSUMPTION, 'order_id': order.id}
+            for order, (_, positions) in zip(orders, accepted)
+            for id, count in get_needed_ingredients(positions).items()
+        ])
+
+    for order, (index, positions) in zip(orders, accepted):
+        results[index] = OrderGet(
+            cost=order.cost,
+            positions=map(
+                lambda struct: PositionFull(
+                    **PositionId.model_validate(struct[0]).model_dump(),
+                    count=struct[1],
+                    ingredients=struct[2]
+                ),
+                positions
             ),
-            positions
-        ),
-        **OrderBase.model_validate(order).model_dump()
-    )
+            **OrderBase.model_validate(order).model_dump()
+        )
+
+    await notify(session, ORDER_EVENTS_CHANNEL, *({'event': 'created', 'id': order.id} for order in orders))
+
+    return results
+
 
+async def create_orders_batch(requests: list[OrderRequest]) -> list[OrderGet | HTTPException]:
+    async with SessionManager().get_session() as session:
+        results = await create_orders(session, requests)
+        await session.commit()
 
-async def get_order_data(order_id: int, session: AsyncSession) -> list[Row]:
-    query = select(Position.__table__.columns, Position_xref_Order.count)
-    query = query.select_from(Position_xref_Order)
-    query = query.join(Position, Position_xref_Order.position_id == Position.id)
-    query = query.where(Position_xref_Order.order_id == order_id)
+    return results
 
-    return (await session.execute(query)).all()
 
+settings = get_settings()
+order_batcher: MicroBatcher[OrderRequest, OrderGet] | None = None
 
-async def get_full_order_data(orders: list[Order], session: AsyncSession) -> list[tuple[Order, int, Row]]:
-    result: list[tuple[Order, int, Row]] = []
+if settings.ORDER_BATCH:
+    order_batcher = MicroBatcher(create_orders_batch, window=settings.ORDER_BATCH_WINDOW, max_size=settings.ORDER_BATCH_SIZE)
+
+
+@router.post('/', response_model=OrderGet)
+async def post_order(
+    table_id: int,
+    data: list[OrderPosition],
+    idempotency_key: str | None = Header(None, max_length=255),
+    session: AsyncSession = Depends(get_async_session)
+):
+    # keyed requests keep their own transaction, a duplicate key waiting inside a shared one would block its batch
+    if order_batcher is not None and idempotency_key is None:
+        return await order_batcher.submit(OrderRequest(table_id, data))
 
-    for order in orders:
-        cost: int = 0
-        order_data = await get_order_data(order.id, session)
+    if idempotency_key is not None:
+        stored = await idempotency_keys.claim(
+            session, idempotency_key, get_request_fingerprint(table_id, [position_data.model_dump() for position_data in data])
+        )
 
-        for position in order_data:
-            cost += (position.cost * position.count)
+        if stored is not None:
+            return replayed_response(stored)
+
+    [result] = await create_orders(session, [OrderRequest(table_id, data)])
+
+    if isinstance(result, HTTPException):
+        raise result
+
+    if idempotency_key is not None:
+        content = dump_json(result.model_dump())
+        await idempotency_keys.store(session, idempotency_key, content)
+
+    await session.commit()
+
+    if idempotency_key is not None:
+        return Response(content=content, media_type='application/json')
 
-        result.append((order, cost, order_data))
-    
     return result
 
 
-@router.get('/all', response_model=list[OrderGetShort])
-async def get_orders(session: AsyncSession = Depends(get_async_session)):
-    orders = (await session.scalars(select(Order))).all()
+# lines of live and archived orders, filters on it are pushed down into both tables
+ORDER_LINES = union_all(*(
+    select(lines.id, lines.order_id, lines.position_id, lines.price, lines.count)
+    for lines in (Position_xref_Order, Position_xref_OrderHistory)
+)).subquery('lines')
+
+# lines show the price the order was created with, not the current position cost;
+# positions of archived orders may be deleted by now, their lines keep the id and price
+ORDER_LINE_COLUMNS = (
+    *(
+        ORDER_LINES.c.position_id.label('id') if column.key == 'id' else column
+        for column in Position.__table__.columns if column.key != 'cost'
+    ),
+    ORDER_LINES.c.price.label('cost'),
+    ORDER_LINES.c.count,
+)
+
+
+def get_all_orders(with_positions: bool = False) -> Subquery:
+    # live and archived orders as one table, filters on it are pushed down into both tables
+    history_columns = OrderHistory.__table__.columns
+    live = select(Order.__table__.columns)
+    archived = select(*(history_columns[column.name] for column in Order.__table__.columns))
+
+    if with_positions:
+        live = live.add_columns(get_order_positions_json(Order, Position_xref_Order))
+        archived = archived.add_columns(get_order_positions_json(OrderHistory, Position_xref_OrderHistory))
+
+    return union_all(live, archived).subquery('orders')
+
+
+async def get_full_order_data(orders_query: Select, session: AsyncSession) -> list[dict]:
+    orders = (await session.execute(orders_query)).all()
+
+    if not orders:
+        return []
+
+    result: dict[int, dict] = {order.id: {**order._asdict(), 'positions': []} for order in orders}
+    ids = list(result)
+
+    query = lambda_stmt(lambda: select(*ORDER_LINE_COLUMNS, ORDER_LINES.c.order_id)
+        .select_from(ORDER_LINES)
+        .outerjoin(Position, ORDER_LINES.c.position_id == Position.id)
+        .where(ORDER_LINES.c.order_id.in_(ids))
+        .order_by(ORDER_LINES.c.order_id, ORDER_LINES.c.id))
+
+    for position in (await session.execute(query)).all():
+        position = position._asdict()
+        result[position.pop('order_id')]['positions'].append(position)
+
+    return list(result.values())
+
+
+def encode_cursor(order: dict) -> str:
+    return base64.urlsafe_b64encode(f'{order["created_at"].isoformat()}|{order["id"]}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(created_at), int(id)
+    except ValueError:
+        raise HTTPException(400, "wrong cursor")
+
+
+def get_order_filters(
+    status: OrderStatus | None = None,
+    table_id: int | None = None,
+    created_from: datetime.datetime | None = None,
+    created_to: datetime.datetime | None = None,
+) -> list[ColumnElement[bool]]:
+    criteria: list[ColumnElement[bool]] = []
+
+    if status is not None:
+        criteria.append(Order.status == status)
+
+    if table_id is not None:
+        criteria.append(Order.table_id == table_id)
+
+    if created_from is not None:
+        criteria.append(Order.created_at >= created_from)
 
-    result = await get_full_order_data(orders, session)
+    if created_to is not None:
+        criteria.append(Order.created_at < created_to)
 
-    return [
-        OrderGetShort(
-            **OrderBase.model_validate(order).model_dump(),
-            cost=cost,
-            positions=order_data
-        ) for order, cost, order_data in result]
+    return criteria
+
+
+async def get_orders_page(
+    query: Select, orders: Table | Subquery, cursor: str | None, limit: int, session: AsyncSession
+) -> JSONResponse:
+    if cursor is not None:
+        query = query.where(tuple_(orders.c.created_at, orders.c.id) > decode_cursor(cursor))
+
+    query = query.order_by(orders.c.created_at, orders.c.id).limit(limit)
+    result = await get_full_order_data(query, session)
+
+    headers = {'X-Next-Cursor': encode_cursor(result[-1])} if len(result) == limit else None
+
+    return JSONResponse(result, headers=headers)
+
+
+@router.get('/all', response_model=list[OrderGetShort])
+async def get_orders(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    criteria: list[ColumnElement[bool]] = Depends(get_order_filters),
+    session: AsyncSession = Depends(get_read_session)
+):
+    # archived orders are listed too
+    orders = get_all_orders()
+    query = select(orders).where(*map(ClauseAdapter(orders).traverse, criteria))
+
+    return await get_orders_page(query, orders, cursor, limit, session)
 
 
 @router.get('/all/current', response_model=list[OrderGetShort])
-async def get_current_orders(session: AsyncSession = Depends(get_async_session)):
-    orders = (await session.scalars(select(Order).where(Order.status != OrderStatus.ISSUED))).all()
+async def get_current_orders(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    criteria: list[ColumnElement[bool]] = Depends(get_order_filters),
+    session: AsyncSession = Depends(get_async_session)
+):
+    query = select(Order.__table__.columns).where(IS_CURRENT, *criteria)
+
+    return await get_orders_page(query, Order.__table__, cursor, limit, session)
+
+
+def get_order_positions_json(
+    orders: type[Order | OrderHistory], lines: type[Position_xref_Order | Position_xref_OrderHistory]
+):
+    # positions of archived orders may be deleted by now, their lines keep the id and price
+    position = func.json_build_object(
+        'id', lines.position_id,
+        'name', Position.name,
+        'cost', lines.price,
+        'count', lines.count,
+    )
+
+    query = select(func.coalesce(
+        func.json_agg(aggregate_order_by(position, lines.id)), literal_column("'[]'::json")
+    ))
+    query = query.select_from(lines)
+    query = query.outerjoin(Position, lines.position_id == Position.id)
+    query = query.where(lines.order_id == orders.id)
+
+    return type_coerce(query.scalar_subquery(), JSON).label('positions')
+
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = (
+    'id', 'table_id', 'status', 'created_at', 'updated_at', 'ended_at', 'cost',
+    'position_id', 'position_name', 'position_cost', 'position_count',
+)
+
+
+def format_export_ndjson(rows: list[Row]) -> bytes:
+    return b''.join(dump_json(row._asdict()) + b'\n' for row in rows)
+
+
+def format_export_csv(rows: list[Row]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for row in rows:
+        order = OrderBase.model_validate(row).model_dump(mode='json')
+        order_data = [order[key] for key in EXPORT_COLUMNS[:6]] + [row.cost]
+
+        if not row.positions:
+            writer.writerow(order_data + [None] * 4)
+
+        for position in row.positions:
+            writer.writerow(order_data + [position['id'], position['name'], position['cost'], position['count']])
+
+    return buffer.getvalue()
+
+
+async def stream_orders_export(
+    query: Select, formatter: Callable[[list[Row]], str | bytes], header: str = ''
+) -> AsyncGenerator[str | bytes, None]:
+    if header:
+        yield header
+
+    # request scoped session is closed before the body is streamed, so export owns its session
+    async with SessionManager().get_session() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        async for rows in result.partitions():
+            yield formatter(rows)
+
 
-    result = await get_full_order_data(orders, session)
+@router.get('/export')
+async def export_orders(
+    export_format: Literal['ndjson', 'csv'] = Query('ndjson', alias='format'),
+    criteria: list[ColumnElement[bool]] = Depends(get_order_filters),
+):
+    # archived orders are exported too
+    orders = get_all_orders(with_positions=True)
+    query = select(orders).where(*map(ClauseAdapter(orders).traverse, criteria))
+    query = query.order_by(orders.c.created_at, orders.c.id)
 
-    return [
-        OrderGetShort(
-            **OrderBase.model_validate(order).model_dump(),
-            cost=cost,
-            positions=order_data
-        ) for order, cost, order_data in result]
+    if export_format == 'csv':
+        header = io.StringIO()
+        csv.writer(header).writerow(EXPORT_COLUMNS)
+
+        content = stream_orders_export(query, format_export_csv, header.getvalue())
+        media_type = 'text/csv'
+    else:
+        content = stream_orders_export(query, format_export_ndjson)
+        media_type = 'application/x-ndjson'
+
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="orders.{export_format}"'}
+    )
+
+
+ORDER_EVENTS_CHANNEL = 'order_events'
+BOARD_HEARTBEAT = 15
+
+
+def format_order_event(event: str, data: str) -> str:
+    return f'event: {event}\ndata: {data}\n\n'
+
+
+async def load_order_event(payload: str) -> str:
+    event = json.loads(payload)
+
+    async with SessionManager().get_session() as session:
+        result = await get_full_order_data(select(Order.__table__.columns).where(Order.id == event['id']), session)
+
+    return format_order_event(event['event'], dump_json(result[0]).decode())
+
+
+order_board = Broadcaster(ORDER_EVENTS_CHANNEL, load_order_event)
+
+
+async def stream_order_board() -> AsyncGenerator[str, None]:
+    # subscribe before taking the snapshot, so no change is lost in between;
+    # clients upsert orders by id, so events already covered by the snapshot are harmless
+    async with order_board.subscribe() as events:
+        async with SessionManager().get_session() as session:
+            query = select(Order.__table__.columns).where(IS_CURRENT)
+            result = await get_full_order_data(query.order_by(Order.created_at, Order.id), session)
+
+        yield format_order_event('snapshot', dump_json(result).decode())
+
+        while True:
+            try:
+                message = await asyncio.wait_for(events.get(), BOARD_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+
+            if message is None:
+                return
+
+            yield message
+
+
+@router.get('/board')
+async def get_order_board():
+    return StreamingResponse(
+        stream_order_board(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @router.patch('/{id}', response_model=OrderBase)
 async def patch_order(id: int, data: OrderPatch, session: AsyncSession = Depends(get_async_session)):
-    order = await session.get(Order, id)
+    # locked, so concurrent status changes can't both count the same order as issued
+    order = await session.get(Order, id, with_for_update={'key_share': True})
 
     if order is None:
         raise HTTPException(404, "no order with such id")
 
+    was_issued = order.status == OrderStatus.ISSUED
+
     if data.status == OrderStatus.ISSUED:
         order.ended_at = datetime.datetime.now()
 
     for key in (dumped_data := data.model_dump(exclude_none=True)):
         setattr(order, key, dumped_data[key])
 
+    reached = get_reached_status_time(order)
+
+    if reached is not None:
+        setattr(order, reached, func.now())
+
     session.add(order)
+
+    if was_issued != (order.status == OrderStatus.ISSUED):
+        await record_sales(session, Position_xref_Order.order_id == order.id, issued=True, sign=-1 if was_issued else 1)
+
+    if reached is not None:
+        await record_kitchen_times(session, order.id, reached)
+
+    await notify(session, ORDER_EVENTS_CHANNEL, {'event': 'updated', 'id': order.id})
     await session.commit()
     await session.refresh(order)
 
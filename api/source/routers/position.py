@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import Row, select
+from collections import defaultdict
+from typing import Iterable
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import (
+    JSON, ColumnElement, Row, Select, delete, func, lambda_stmt, literal_column, or_, select, type_coerce, update
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from db.models import Ingredient, Position, Position_xref_Ingredient
+from db.models import Ingredient, Position, Position_xref_Ingredient, Position_xref_Order, PendingStock
+from routers.cache import cached_response, menu_cache
+from routers.responses import JSONResponse, dump_json
 from routers.schemas import (
-    IngredientFull, IngredientPostForPosition, IngredientPostForPositionRead, PositionAvailable, PositionBase,
-    PositionGet, PositionGetFull, PositionId, PositionPatch, PositionPost, PositionWithAvailability, PositionsAvailable
+    CartAvailability, CartPosition, IngredientPostForPosition, IngredientPostForPositionRead, PositionAvailable,
+    PositionBase, PositionGet, PositionId, PositionPatch, PositionPost, PositionsAvailable
 )
-from db.engine import get_async_session
+from db.engine import get_async_session, get_read_session
 
 
 router = APIRouter(
@@ -17,6 +25,23 @@ router = APIRouter(
 )
 
 
+async def lock_ingredients(session: AsyncSession, *criteria) -> dict[int, Row]:
+    # recipe writes take ingredient locks before touching position_xref_ingredient rows,
+    # in the same id order as orders do, so they can't deadlock with stock updates
+    query = select(Ingredient.id, Ingredient.name).where(*criteria)
+    query = query.order_by(Ingredient.id).with_for_update(read=True)
+
+    return {ingredient.id: ingredient for ingredient in (await session.execute(query)).all()}
+
+
+async def refresh_positions_availability(session: AsyncSession, *criteria) -> None:
+    query = update(Position_xref_Ingredient).where(
+        Position_xref_Ingredient.ingredient_id == Ingredient.id, *criteria
+    ).values(makeable=Ingredient.available // Position_xref_Ingredient.count)
+
+    await session.execute(query, execution_options={'synchronize_session': False})
+
+
 @router.post('/', response_model=PositionGet)
 async def add_new_position(data: PositionPost, session: AsyncSession = Depends(get_async_session)):
     position = (await session.scalar(select(Position).where(Position.name == data.name)))
@@ -24,21 +49,25 @@ async def add_new_position(data: PositionPost, session: AsyncSession = Depends(g
     if position is not None:
         raise HTTPException(400, "position with such name already exist")
     
-    ingredients: list[tuple[Ingredient, int]] = []
+    ingredients: list[tuple[Row, int]] = []
     if data.ingredients_id is not None and len(data.ingredients_id):
-        for ingredient_data in data.ingredients_id:
-            ingredient = await session.get(Ingredient, ingredient_data.id)
+        # a repeated ingredient id keeps its last count, like PUT /position/{id}/ingredients
+        counts: dict[int, int] = {ingredient_data.id: ingredient_data.count for ingredient_data in data.ingredients_id}
+        locked = await lock_ingredients(session, Ingredient.id.in_(counts))
+
+        for ingredient_id, count in counts.items():
+            ingredient = locked.get(ingredient_id)
 
             if ingredient is None:
                 raise HTTPException(404, "wrong ingredient id")
 
-            ingredients.append((ingredient, ingredient_data.count))
+            ingredients.append((ingredient, count))
 
     delattr(data, "ingredients_id")
     position = Position(**data.model_dump())
 
     session.add(position)
-    await session.commit()
+    await session.flush()
     await session.refresh(position)
 
     for ingredient, count in ingredients:
@@ -49,7 +78,10 @@ async def add_new_position(data: PositionPost, session: AsyncSession = Depends(g
                 count=count,
         ))
 
+    await session.flush()
+    await refresh_positions_availability(session, Position_xref_Ingredient.position_id == position.id)
     await session.commit()
+    menu_cache.invalidate()
 
     return PositionGet(
         id=position.id,
@@ -66,43 +98,49 @@ async def add_new_position(data: PositionPost, session: AsyncSession = Depends(g
 
 
 @router.get('/all', response_model=list[PositionGet])
-async def get_all_positions(session: AsyncSession = Depends(get_async_session)):
-    positions = (await session.scalars(select(Position))).all()
+async def get_all_positions(request: Request, session: AsyncSession = Depends(get_async_session)):
+    if (entry := menu_cache.get('all')) is None:
+        generation = menu_cache.generation
 
-    result = []
-    for position in positions:
-        query = select(Ingredient.id, Ingredient.name, Position_xref_Ingredient.count)
-        query = query.select_from(Position_xref_Ingredient)
-        query = query.join(Ingredient, Position_xref_Ingredient.ingredient_id == Ingredient.id)
-        query = query.where(Position_xref_Ingredient.position_id == position.id)
-
-        ingredients_data = (await session.execute(query)).all()
-
-        result.append(PositionGet(
-            id=position.id,
-            ingredients=map(
-                lambda data: IngredientPostForPosition(**data._mapping),
-                ingredients_data
-            ),
-            **PositionBase.model_validate(position).model_dump()
-        ))
+        query = select(
+            Position.__table__.columns,
+            get_ingredients_json(Ingredient.id.is_not(None)).label('ingredients')
+        )
+        query = query.select_from(Position)
+        query = query.outerjoin(Position_xref_Ingredient, Position_xref_Ingredient.position_id == Position.id)
+        query = query.outerjoin(Ingredient, Position_xref_Ingredient.ingredient_id == Ingredient.id)
+        query = query.group_by(Position.id).order_by(Position.id)
 
-    return result
+        positions = (await session.execute(query)).all()
+        entry = menu_cache.set('all', dump_json([position._asdict() for position in positions]), generation)
+
+    return cached_response(request, entry)
 
 
 @router.delete('/{id}')
 async def delete_position(id: int, session: AsyncSession = Depends(get_async_session)):
-    position = await session.get(Position, id)
+    position = await session.get(Position, id, with_for_update={'key_share': True})
 
     if position is None:
         raise HTTPException(404, "no position with such id")
 
-    query = select(Position_xref_Ingredient).where(Position_xref_Ingredient.position_id == position.id)
+    await lock_ingredients(session, Ingredient.id.in_(
+        select(Position_xref_Ingredient.ingredient_id).where(Position_xref_Ingredient.position_id == position.id)
+    ))
 
-    for connection in (await session.scalars(query)).all():
-        await session.delete(connection)
-    
-    await session.delete(position)
+    # orders keep their lines and the prices in them, a position can only go once its orders are archived;
+    # orders for it wait on the ingredient locks taken above, so none adds a line after this check
+    lines = select(Position_xref_Order.id).where(Position_xref_Order.position_id == id)
+
+    if await session.scalar(select(lines.exists())):
+        raise HTTPException(409, "position is used by orders")
+
+    # plain statements, deleting the object would also delete its order lines through the secondary relationship,
+    # this way a line slipping past the check fails the foreign key instead
+    await session.execute(delete(Position_xref_Ingredient).where(Position_xref_Ingredient.position_id == id))
+    await session.execute(delete(Position).where(Position.id == id))
+    await session.commit()
+    menu_cache.invalidate()
 
 
 @router.patch('/{id}', response_model=PositionId)
@@ -117,6 +155,7 @@ async def patch_position(id: int, data: PositionPatch, session: AsyncSession = D
     
     session.add(position)
     await session.commit()
+    menu_cache.invalidate()
 
     result = PositionId.model_validate(position)
 
@@ -125,155 +164,181 @@ async def patch_position(id: int, data: PositionPatch, session: AsyncSession = D
 
 @router.put('/{id}/ingredients', response_model=PositionGet)
 async def patch_position_ingredients(id: int, data: list[IngredientPostForPositionRead], session: AsyncSession = Depends(get_async_session)):
-    position = await session.get(Position, id)
+    position = await session.get(Position, id, with_for_update={'key_share': True})
 
     if position is None:
         raise HTTPException(404, "no position with such id")
 
-    query = select(Position_xref_Ingredient).where(
-        Position_xref_Ingredient.position_id == id
-    ).order_by(Position_xref_Ingredient.ingredient_id)
-    connections: list[Position_xref_Ingredient] = (await session.scalars(query)).all()
-
-    def binary_search(array: list[Position_xref_Ingredient], _id: int) -> Position_xref_Ingredient | None:
-        start, end = 0, len(array) - 1
-
-        while end >= start:
-            index = (start + end) // 2
-
-            if (obj := array[index]).ingredient_id == _id:
-                return obj
-            
-            if obj.ingredient_id > _id:
-                start = index + 1
-            else:
-                end = index - 1
-        
-        return None
-
-    # list of turple of Ingredient, number of ingredients in position 
-    # and aleready existing connection in database
-    new_ingredients: list[tuple[Ingredient, int, bool]] = []
-
-    for ingredient_data in data:
-        ingredient = await session.get(Ingredient, ingredient_data.id)
-
-        if ingredient is None:
-            raise HTTPException(400, "wrong ingredient id")
-        
-        search_result = binary_search(connections, ingredient.id)
-
-        if (already := search_result is not None):
-            if search_result.count != ingredient_data.count:
-                search_result.count = ingredient_data.count
-                session.add(search_result)
-
-            connections.remove(search_result)
-    
-        new_ingredients.append((ingredient, ingredient_data.count, already))
-    
-    for ingredient, count, already in new_ingredients:
-        if already:
-            continue
-
-        session.add(
-            Position_xref_Ingredient(
-                position_id=position.id,
-                ingredient_id=ingredient.id,
-                count=count
-        ))
-
+    ingredients: dict[int, int] = {ingredient_data.id: ingredient_data.count for ingredient_data in data}
+
+    # also locks ingredients of the links that are about to be removed
+    locked = await lock_ingredients(session, or_(
+        Ingredient.id.in_(ingredients),
+        Ingredient.id.in_(select(Position_xref_Ingredient.ingredient_id).where(Position_xref_Ingredient.position_id == id))
+    ))
+
+    if any(ingredient_id not in locked for ingredient_id in ingredients):
+        raise HTTPException(400, "wrong ingredient id")
+
+    if ingredients:
+        query = insert(Position_xref_Ingredient).values([{
+            'position_id': id,
+            'ingredient_id': ingredient_id,
+            'count': count,
+        } for ingredient_id, count in ingredients.items()])
+        query = query.on_conflict_do_update(
+            index_elements=[Position_xref_Ingredient.position_id, Position_xref_Ingredient.ingredient_id],
+            set_={'count': query.excluded.count},
+            where=Position_xref_Ingredient.count != query.excluded.count
+        )
+
+        await session.execute(query)
+
+    await session.execute(delete(Position_xref_Ingredient).where(
+        Position_xref_Ingredient.position_id == id,
+        Position_xref_Ingredient.ingredient_id.not_in(ingredients)
+    ))
+
+    await refresh_positions_availability(session, Position_xref_Ingredient.position_id == id)
     await session.commit()
-    
-    for connection in connections:
-        await session.delete(connection)
-    
+    menu_cache.invalidate()
+
     return PositionGet(
         id=position.id,
         **PositionBase.model_validate(position).model_dump(),
-        ingredients=map(lambda struct: IngredientPostForPosition(
-            id=struct[0].id,
-            name=struct[0].name,
-            count=struct[1]
-        ), new_ingredients)
+        ingredients=[IngredientPostForPosition(
+            id=ingredient_id,
+            name=locked[ingredient_id].name,
+            count=count
+        ) for ingredient_id, count in ingredients.items()]
     )
 
 
-async def get_position_data(position_id: int, session: AsyncSession) -> list[Row]:
-    query = select(Ingredient.id, Ingredient.name, Ingredient.available, Position_xref_Ingredient.count)
-    query = query.select_from(Position_xref_Ingredient)
-    query = query.join(Ingredient, Position_xref_Ingredient.ingredient_id == Ingredient.id)
-    query = query.where(Position_xref_Ingredient.position_id == position_id)
+def get_ingredients_json(criteria, available: ColumnElement[int] | None = None):
+    fields = ('id', Ingredient.id, 'name', Ingredient.name, 'count', Position_xref_Ingredient.count)
 
-    return (await session.execute(query)).all()
+    if available is not None:
+        fields += ('available', available)
 
+    ingredient = func.json_build_object(*fields)
+    ingredients = func.json_agg(aggregate_order_by(ingredient, Ingredient.id)).filter(criteria)
 
-async def sort_ingredient_data(ingredients_data: list[Row]) -> tuple[list[IngredientFull], list[IngredientFull], int]:
-    number: float = float('+inf')
-    available_ingredients: list[IngredientFull] = []
-    unavailable_ingredients: list[IngredientFull] = []
+    return type_coerce(func.coalesce(ingredients, literal_column("'[]'::json")), JSON)
 
-    for ingredient_data in ingredients_data:
-        current = ingredient_data.available // ingredient_data.count
-        ingredient = IngredientFull.model_validate(ingredient_data)
 
-        if current == 0:
-            unavailable_ingredients.append(ingredient)
-        else:
-            available_ingredients.append(ingredient)
-        
-        number = min(number, current)
-    
-    if number == float('inf'):
-        number = -1
+def get_positions_availability_query() -> Select:
+    # restocks still waiting for the stock folder count as stock, orders fold them when they need them
+    pending = select(PendingStock.ingredient_id, func.sum(PendingStock.delta).label('delta'))
+    pending = pending.group_by(PendingStock.ingredient_id).subquery('pending')
 
-    return available_ingredients, unavailable_ingredients, int(number)
+    available = Ingredient.available + func.coalesce(pending.c.delta, 0)
+    number = func.coalesce(
+        (Ingredient.available + pending.c.delta) // Position_xref_Ingredient.count, Position_xref_Ingredient.makeable
+    )
+
+    query = select(
+        Position.__table__.columns,
+        func.coalesce(func.min(number), -1).label('available'),
+        get_ingredients_json(number != 0, available).label('available_ingredients'),
+        get_ingredients_json(number == 0, available).label('unavailable_ingredients'),
+    )
+    query = query.select_from(Position)
+    query = query.outerjoin(Position_xref_Ingredient, Position_xref_Ingredient.position_id == Position.id)
+    query = query.outerjoin(Ingredient, Position_xref_Ingredient.ingredient_id == Ingredient.id)
+    query = query.outerjoin(pending, pending.c.ingredient_id == Ingredient.id)
+
+    return query.group_by(Position.id).order_by(Position.id)
+
+
+async def get_positions_availability(session: AsyncSession, ids: Iterable[int] | None = None) -> list[Row]:
+    # lambda statements are built once, later calls only bind ids
+    query = lambda_stmt(get_positions_availability_query)
+
+    if ids is not None:
+        ids = list(ids)
+        query += lambda query: query.where(Position.id.in_(ids))
+
+    return (await session.execute(query)).all()
 
 
 @router.get('/availability/{id}', response_model=PositionAvailable)
 async def get_available_position(id: int, session: AsyncSession = Depends(get_async_session)):
-    position = await session.get(Position, id)
+    positions = await get_positions_availability(session, [id])
 
-    if position is None:
+    if not positions:
         raise HTTPException(400, 'no position with such id')
 
-    ingredients_data = await get_position_data(position.id, session)
-
-    _, unavailable_ingredients, number = await sort_ingredient_data(ingredients_data)
+    position = positions[0]
 
     return PositionAvailable(
-        avalible=number,
-        unavailable_ingredients=unavailable_ingredients,
+        avalible=position.available,
+        unavailable_ingredients=position.unavailable_ingredients,
         **PositionId.model_validate(position).model_dump()
     )
 
 
-@router.get('/all/availability', response_model=PositionsAvailable)
-async def get_all_available_position(session: AsyncSession = Depends(get_async_session)):
-    positions = (await session.scalars(select(Position))).all()
+@router.post('/availability', response_model=CartAvailability)
+async def get_cart_availability(data: list[CartPosition], session: AsyncSession = Depends(get_read_session)):
+    counts: dict[int, int] = defaultdict(int)
+
+    for position_data in data:
+        counts[position_data.id] += position_data.count
+
+    positions = await get_positions_availability(session, counts) if counts else []
 
-    available_positions: list[tuple[Position, int, list[IngredientFull]]] = []
-    unavailable_positions: list[tuple[Position, list[IngredientFull], list[IngredientFull]]] = []
+    if len(positions) != len(counts):
+        raise HTTPException(400, 'no position with such id')
+
+    # positions sharing an ingredient compete for the same stock, so the cart is checked on ingredient totals
+    needed: dict[int, int] = defaultdict(int)
+    ingredients: dict[int, dict] = {}
+    result = []
 
     for position in positions:
-        ingredients_data = await get_position_data(position.id, session)
-
-        available_ingredients, unavailable_ingredients, number = await sort_ingredient_data(ingredients_data)
-        
-        if number == 0:
-            unavailable_positions.append((position, available_ingredients, unavailable_ingredients))
-        else:
-            available_positions.append((position, number, available_ingredients))
-
-    return PositionsAvailable(
-        available=map(lambda struct: PositionGetFull(
-            available=struct[1],
-            ingredients=struct[2],
-            **PositionId.model_validate(struct[0]).model_dump()
-        ), available_positions),
-        unavailable=map(lambda struct: PositionWithAvailability(
-            available_ingredients=struct[1],
-            unavailable_ingredients=struct[2],
-            **PositionId.model_validate(struct[0]).model_dump()
-        ), unavailable_positions)
-    )
+        count = counts[position.id]
+
+        for ingredient in (*position.available_ingredients, *position.unavailable_ingredients):
+            needed[ingredient['id']] += ingredient['count'] * count
+            ingredients[ingredient['id']] = ingredient
+
+        position_data = position._asdict()
+        del position_data['available_ingredients'], position_data['unavailable_ingredients']
+
+        result.append({
+            **position_data,
+            'count': count,
+            # -1 is a position without ingredients, it can always be made
+            'makeable': position.available == -1 or position.available >= count,
+        })
+
+    missing = [{
+        'id': id,
+        'name': ingredients[id]['name'],
+        'needed': count,
+        'available': ingredients[id]['available'],
+    } for id, count in sorted(needed.items()) if count > ingredients[id]['available']]
+
+    return JSONResponse({'makeable': not missing, 'positions': result, 'missing_ingredients': missing})
+
+
+@router.get('/all/availability', response_model=PositionsAvailable)
+async def get_all_available_position(session: AsyncSession = Depends(get_read_session)):
+    available, unavailable = [], []
+
+    for position in await get_positions_availability(session):
+        position_data = position._asdict()
+        available_ingredients = position_data.pop('available_ingredients')
+        unavailable_ingredients = position_data.pop('unavailable_ingredients')
+
+        if position.available != 0:
+            available.append({**position_data, 'ingredients': available_ingredients})
+            continue
+
+        del position_data['available']
+        unavailable.append({
+            **position_data,
+            'available_ingredients': available_ingredients,
+            'unavailable_ingredients': unavailable_ingredients,
+        })
+
+    return JSONResponse({'available': available, 'unavailable': unavailable})
@@ -0,0 +1,18 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+# pydantic writes utc datetimes with a Z suffix, keep the same format on the fast path
+JSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dump_json(content: Any) -> bytes:
+    return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+# handlers returning plain dicts and rows through this class skip response_model validation entirely
+class JSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
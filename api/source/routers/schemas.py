@@ -1,7 +1,7 @@
 import datetime
 from pydantic import BaseModel, field_validator, model_validator
 
-from db.models import OrderStatus
+from db.models import KitchenStage, OrderStatus, StockMovementReason
 
 
 class AtLeastOneValidator:
@@ -30,6 +30,27 @@ class IngredientPatch(BaseModel, AtLeastOneValidator):
     available: int | None = None
 
 
+class IngredientStockDelta(BaseModel):
+    id: int
+    delta: int
+    reason: StockMovementReason = StockMovementReason.CORRECTION
+
+    @field_validator('reason')
+    @classmethod
+    def reason_checker(cls, value: StockMovementReason) -> StockMovementReason:
+        if value == StockMovementReason.CONSUMPTION:
+            raise ValueError("consumption is recorded by orders")
+        return value
+
+
+class StockMovementGet(BaseModel):
+    id: int
+    ingredient_id: int
+    delta: int
+    reason: StockMovementReason
+    order_id: int | None = None
+    created_at: datetime.datetime
+
 
 class PositionBase(BaseModel):
     name: str
@@ -82,8 +103,9 @@ class PositionShort(PositionId):
     count: int
 
 
-class PositionGetFull(PositionFull):
+class PositionGetFull(PositionId):
     available: int
+    ingredients: list[IngredientFull]
 
 
 class PositionWithAvailability(PositionId):
@@ -120,6 +142,29 @@ class OrderPosition(BaseModel):
         return value
 
 
+class CartPosition(OrderPosition):
+    count: int = 1
+
+
+class PositionCartAvailability(PositionId):
+    count: int
+    available: int
+    makeable: bool
+
+
+class IngredientShortage(BaseModel):
+    id: int
+    name: str
+    needed: int
+    available: int
+
+
+class CartAvailability(BaseModel):
+    makeable: bool
+    positions: list[PositionCartAvailability]
+    missing_ingredients: list[IngredientShortage]
+
+
 class PositionInOrder(PositionId):
     count: int
 
@@ -131,6 +176,9 @@ class OrderBase(BaseModel):
     created_at: datetime.datetime
     updated_at: datetime.datetime
     ended_at: datetime.datetime | None = None
+    progress_at: datetime.datetime | None = None
+    ready_at: datetime.datetime | None = None
+    issued_at: datetime.datetime | None = None
 
     class Config:
         from_attributes = True
@@ -149,3 +197,31 @@ class OrderGet(OrderBase):
 
 class OrderGetShort(OrderGet):
     positions: list[PositionShort]
+
+
+class SalesTotals(BaseModel):
+    units: int
+    revenue: int
+    issued_units: int
+    issued_revenue: int
+
+
+class SalesPeriod(SalesTotals):
+    period: datetime.datetime
+    position_id: int | None = None
+
+
+class PositionSales(SalesTotals):
+    id: int
+    name: str | None
+
+
+class KitchenTimes(BaseModel):
+    stage: KitchenStage
+    period: datetime.datetime | None = None
+    hour: int | None = None
+    position_id: int | None = None
+    orders: int
+    p50: float
+    p90: float
+    p99: float
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import httpx
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+# statements are only counted in DEBUG mode, see db/engine.py
+os.environ['DEBUG'] = 'true'
+
+from config import get_settings  # noqa: E402
+
+# the tests get their own database next to the configured one, created on first use and emptied before every test
+SERVER_URL = make_url(get_settings().SQLALCHEMY_URL)
+TEST_URL = SERVER_URL.set(database=f'{SERVER_URL.database}_test')
+
+os.environ['SQLALCHEMY_URL'] = TEST_URL.render_as_string(hide_password=False)
+get_settings.cache_clear()
+
+from db.engine import SessionManager  # noqa: E402
+from db.models import Base  # noqa: E402
+from main import app  # noqa: E402
+from routers.cache import menu_cache  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(scope='session')
+async def database():
+    engine = create_async_engine(SERVER_URL, isolation_level='AUTOCOMMIT')
+
+    async with engine.connect() as connection:
+        query = text('SELECT 1 FROM pg_database WHERE datname = :name').bindparams(name=TEST_URL.database)
+
+        if await connection.scalar(query) is None:
+            await connection.execute(text(f'CREATE DATABASE "{TEST_URL.database}"'))
+
+    await engine.dispose()
+
+    # the schema the models describe, migrations are checked against it with `alembic check`
+    async with SessionManager().async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+    yield
+
+    await SessionManager().async_engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+async def clean_database(database):
+    tables = ', '.join(f'"{table.name}"' for table in Base.metadata.sorted_tables)
+
+    async with SessionManager().async_engine.begin() as connection:
+        await connection.execute(text(f'TRUNCATE {tables} RESTART IDENTITY CASCADE'))
+
+    menu_cache.invalidate()
+
+
+@pytest.fixture(scope='session')
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+
+
+@pytest.fixture
+async def menu(client: httpx.AsyncClient) -> dict[str, list[int]]:
+    # a few rows of everything, so a query per row can't hide behind a single row
+    ingredients: list[int] = []
+    positions: list[int] = []
+    orders: list[int] = []
+
+    for i in range(5):
+        response = await client.post('/ingredient/', json={'name': f'ingredient-{i}', 'available': 1000})
+        ingredients.append(response.json()['id'])
+
+    for i in range(5):
+        response = await client.post('/position/', json={
+            'name': f'position-{i}',
+            'cost': 100 + i,
+            'is_changable': False,
+            'ingredients_id': [{'id': ingredients[i], 'count': 1}, {'id': ingredients[(i + 1) % 5], 'count': 2}],
+        })
+        positions.append(response.json()['id'])
+
+    for i in range(5):
+        response = await client.post('/order/', params={'table_id': i + 1}, json=[
+            {'id': positions[i], 'count': 1}, {'id': positions[(i + 1) % 5], 'count': 2}
+        ])
+        orders.append(response.json()['id'])
+
+    return {'ingredients': ingredients, 'positions': positions, 'orders': orders}
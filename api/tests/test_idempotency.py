@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import pytest
+
+from routers.idempotency import REPLAYED_HEADER, idempotency_keys
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def position_id(client: httpx.AsyncClient) -> int:
+    ingredient_id = (await client.post('/ingredient/', json={'name': 'tea', 'available': 100})).json()['id']
+    response = await client.post('/position/', json={
+        'name': 'tea', 'cost': 100, 'is_changable': False, 'ingredients_id': [{'id': ingredient_id, 'count': 1}]
+    })
+
+    return response.json()['id']
+
+
+def post_order(client: httpx.AsyncClient, key: str, position_id: int, count: int = 1):
+    return client.post(
+        '/order/', params={'table_id': 1}, json=[{'id': position_id, 'count': count}], headers={'Idempotency-Key': key}
+    )
+
+
+async def test_concurrent_requests_with_one_key_create_one_order(client: httpx.AsyncClient, position_id: int):
+    responses = await asyncio.gather(*(post_order(client, 'key', position_id) for _ in range(5)))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.content for response in responses}) == 1
+    assert sorted(REPLAYED_HEADER in response.headers for response in responses) == [False] + [True] * 4
+
+    assert len((await client.get('/order/all')).json()) == 1
+
+
+async def test_key_reused_for_another_request(client: httpx.AsyncClient, position_id: int):
+    assert (await post_order(client, 'key', position_id)).status_code == 200
+
+    response = await post_order(client, 'key', position_id, count=2)
+    assert response.status_code == 422, response.text
+
+    assert len((await client.get('/order/all')).json()) == 1
+
+
+async def test_expired_key_is_claimed_again(
+    client: httpx.AsyncClient, position_id: int, monkeypatch: pytest.MonkeyPatch
+):
+    # keys expire as soon as they are written
+    monkeypatch.setattr(idempotency_keys, 'ttl', 0)
+
+    first = await post_order(client, 'key', position_id)
+    second = await post_order(client, 'key', position_id, count=2)
+
+    assert first.status_code == second.status_code == 200
+    assert REPLAYED_HEADER not in second.headers
+    assert first.json()['id'] != second.json()['id']
+
+    assert len((await client.get('/order/all')).json()) == 2
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+import pytest
+
+import routers.ingredient
+from db.engine import SessionManager
+from db.models import Ingredient, StockMovementReason
+from routers.ingredient import StockFolder, record_stock_movements
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def deferred_restocks(monkeypatch: pytest.MonkeyPatch) -> StockFolder:
+    # restocks go to pending_stock, the folder isn't started so they stay there until the test folds them
+    stock_folder = StockFolder(interval=60, batch_size=100)
+    monkeypatch.setattr(routers.ingredient, 'stock_folder', stock_folder)
+
+    return stock_folder
+
+
+async def test_patch_ingredient_counts_pending_restocks(client: httpx.AsyncClient, deferred_restocks: StockFolder):
+    ingredient_id = (await client.post('/ingredient/', json={'name': 'milk', 'available': 1})).json()['id']
+
+    response = await client.patch('/ingredient/stock', json=[{'id': ingredient_id, 'delta': 5, 'reason': 'DELIVERY'}])
+    assert response.json() == [{'id': ingredient_id, 'name': 'milk', 'available': 6}]
+
+    response = await client.patch(f'/ingredient/{ingredient_id}', json={'name': 'oat milk'})
+    assert response.status_code == 200, response.text
+    assert response.json() == {'id': ingredient_id, 'name': 'oat milk', 'available': 6}
+
+    assert (await client.get('/ingredient/all')).json() == [{'id': ingredient_id, 'name': 'oat milk', 'available': 6}]
+
+
+async def test_upsert_without_stock_counts_pending_restocks(client: httpx.AsyncClient, deferred_restocks: StockFolder):
+    ingredient_id = (await client.post('/ingredient/', json={'name': 'salt', 'available': 1})).json()['id']
+    await client.patch('/ingredient/stock', json=[{'id': ingredient_id, 'delta': 5, 'reason': 'DELIVERY'}])
+
+    response = await client.put('/ingredient/bulk', json=[{'name': 'salt'}, {'name': 'pepper', 'available': 2}])
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {'id': ingredient_id, 'name': 'salt', 'available': 6},
+        {'id': ingredient_id + 1, 'name': 'pepper', 'available': 2},
+    ]
+
+
+async def test_upsert_racing_an_insert_keeps_the_ledger(client: httpx.AsyncClient):
+    # another request inserts the same new name and is still uncommitted when the upsert starts
+    async with SessionManager().get_session() as session:
+        ingredient = Ingredient(name='sugar', available=10)
+        session.add(ingredient)
+        await session.flush()
+        await record_stock_movements(session, [
+            {'ingredient_id': ingredient.id, 'delta': 10, 'reason': StockMovementReason.CORRECTION}
+        ])
+
+        upsert = asyncio.create_task(client.put('/ingredient/bulk', json=[{'name': 'sugar', 'available': 25}]))
+        # long enough for the upsert to wait on the uncommitted row
+        await asyncio.sleep(0.2)
+        await session.commit()
+
+    response = await upsert
+    assert response.status_code == 200, response.text
+    assert response.json() == [{'id': ingredient.id, 'name': 'sugar', 'available': 25}]
+
+    movements = (await client.get(f'/ingredient/{ingredient.id}/movements')).json()
+    assert [movement['delta'] for movement in movements] == [15, 10]
@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import pytest
+
+import routers.order
+from db.archive import OrderArchiver
+from db.batch import MicroBatcher
+from db.engine import SessionManager
+from routers.order import OrderRequest, create_orders_batch
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def order_batches(monkeypatch: pytest.MonkeyPatch):
+    # what ORDER_BATCH=true sets up, with a window wide enough for all orders of a test to share one batch;
+    # returns the sizes of the batches run
+    sizes: list[int] = []
+
+    async def handler(requests: list[OrderRequest]):
+        sizes.append(len(requests))
+        return await create_orders_batch(requests)
+
+    order_batcher = MicroBatcher(handler, window=0.2, max_size=64)
+    monkeypatch.setattr(routers.order, 'order_batcher', order_batcher)
+
+    yield sizes
+
+    await order_batcher.stop()
+
+
+async def create_position(client: httpx.AsyncClient, name: str, stock: int, count: int) -> tuple[int, int]:
+    ingredient_id = (await client.post('/ingredient/', json={'name': name, 'available': stock})).json()['id']
+    response = await client.post('/position/', json={
+        'name': name, 'cost': 100, 'is_changable': False, 'ingredients_id': [{'id': ingredient_id, 'count': count}]
+    })
+    assert response.status_code == 200, response.text
+
+    return response.json()['id'], ingredient_id
+
+
+async def get_available(client: httpx.AsyncClient, ingredient_id: int) -> int:
+    ingredients = (await client.get('/ingredient/all')).json()
+
+    return next(ingredient['available'] for ingredient in ingredients if ingredient['id'] == ingredient_id)
+
+
+async def test_concurrent_orders_dont_oversell(client: httpx.AsyncClient):
+    # stock for exactly 3 orders
+    position_id, ingredient_id = await create_position(client, 'soup', stock=600, count=200)
+
+    responses = await asyncio.gather(*(
+        client.post('/order/', params={'table_id': table_id}, json=[{'id': position_id, 'count': 1}])
+        for table_id in range(20)
+    ))
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] * 3 + [400] * 17
+    assert await get_available(client, ingredient_id) == 0
+    assert len((await client.get('/order/all')).json()) == 3
+
+
+async def test_failing_orders_dont_fail_their_batch(client: httpx.AsyncClient, order_batches: list[int]):
+    position_id, ingredient_id = await create_position(client, 'pie', stock=3, count=1)
+
+    responses = await asyncio.gather(*(
+        client.post('/order/', params={'table_id': 1}, json=data) for data in (
+            [{'id': position_id, 'count': 1}],
+            [{'id': position_id, 'count': 5}],  # more than there is
+            [{'id': position_id, 'count': 2}],
+            [{'id': position_id + 1, 'count': 1}],  # no such position
+        )
+    ))
+
+    assert order_batches == [4]
+    assert [response.status_code for response in responses] == [200, 400, 200, 400]
+
+    # the two good orders are committed with their stock
+    orders = (await client.get('/order/all')).json()
+    assert sorted(order['id'] for order in orders) == sorted(responses[index].json()['id'] for index in (0, 2))
+    assert await get_available(client, ingredient_id) == 0
+
+
+async def test_archived_orders_are_listed(client: httpx.AsyncClient):
+    position_id, _ = await create_position(client, 'tea', stock=10, count=1)
+    order_ids = []
+
+    for table_id in range(2):
+        response = await client.post('/order/', params={'table_id': table_id}, json=[{'id': position_id, 'count': 1}])
+        order_ids.append(response.json()['id'])
+
+    for status in ('PROGRESS', 'READY', 'ISSUED'):
+        await client.patch(f'/order/{order_ids[0]}', json={'status': status})
+
+    listed = (await client.get('/order/all')).json()
+
+    async with SessionManager().get_session() as session:
+        assert await OrderArchiver(age=0, interval=60, batch_size=100).archive_batch(session) == 1
+        await session.commit()
+
+    assert (await client.get('/order/all')).json() == listed
+    assert (await client.get('/order/all', params={'table_id': 0})).json() == listed[:1]
+    assert (await client.get('/order/all', params={'limit': 1})).headers['X-Next-Cursor']
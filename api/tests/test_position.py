@@ -0,0 +1,41 @@
+import httpx
+import pytest
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_position(client: httpx.AsyncClient, name: str, ingredient_id: int) -> int:
+    response = await client.post('/position/', json={
+        'name': name, 'cost': 100, 'is_changable': False, 'ingredients_id': [{'id': ingredient_id, 'count': 1}]
+    })
+    assert response.status_code == 200, response.text
+
+    return response.json()['id']
+
+
+async def test_delete_position_used_by_orders(client: httpx.AsyncClient):
+    ingredient_id = (await client.post('/ingredient/', json={'name': 'flour', 'available': 10})).json()['id']
+    used = await create_position(client, 'bread', ingredient_id)
+    unused = await create_position(client, 'bun', ingredient_id)
+
+    response = await client.post('/order/', params={'table_id': 1}, json=[{'id': used, 'count': 2}])
+    assert response.status_code == 200, response.text
+    order_id = response.json()['id']
+
+    response = await client.delete(f'/position/{used}')
+    assert response.status_code == 409, response.text
+
+    # the order still adds up to the price it was created with
+    orders = (await client.get('/order/all')).json()
+    assert [order['id'] for order in orders] == [order_id]
+
+    order = orders[0]
+    assert order['cost'] == sum(position['cost'] * position['count'] for position in order['positions']) == 200
+    assert [(position['id'], position['count']) for position in order['positions']] == [(used, 2)]
+
+    response = await client.delete(f'/position/{unused}')
+    assert response.status_code == 200, response.text
+
+    positions = (await client.get('/position/all')).json()
+    assert [position['id'] for position in positions] == [used]
@@ -0,0 +1,60 @@
+from typing import Any, Callable
+
+import httpx
+import pytest
+
+from metrics import assert_statement_budget
+from routers.cache import menu_cache
+
+
+pytestmark = pytest.mark.anyio
+
+Menu = dict[str, list[int]]
+
+# room for a statement or two more before a route fails; the menu has 5 rows of everything,
+# so a route that starts querying once per row still goes over it
+STATEMENT_MARGIN = 2
+
+# (method, route, measured statements, request builder); the counts don't grow with the number of rows
+ROUTE_BUDGETS: list[tuple[str, str, int, Callable[[Menu], tuple[str, dict[str, Any]]]]] = [
+    ('GET', '/position/all', 1, lambda menu: ('/position/all', {})),
+    ('GET', '/position/all/availability', 1, lambda menu: ('/position/all/availability', {})),
+    ('GET', '/position/availability/{id}', 1, lambda menu: (f'/position/availability/{menu["positions"][0]}', {})),
+    ('POST', '/position/availability', 1, lambda menu: (
+        '/position/availability', {'json': [{'id': id, 'count': 2} for id in menu['positions']]}
+    )),
+    ('GET', '/order/all', 2, lambda menu: ('/order/all', {})),
+    ('GET', '/order/all/current', 2, lambda menu: ('/order/all/current', {})),
+    ('POST', '/order/', 10, lambda menu: (
+        '/order/', {'params': {'table_id': 1}, 'json': [{'id': id, 'count': 1} for id in menu['positions']]}
+    )),
+    ('PATCH', '/order/{id}', 4, lambda menu: (f'/order/{menu["orders"][0]}', {'json': {'status': 'PROGRESS'}})),
+    ('GET', '/ingredient/all', 1, lambda menu: ('/ingredient/all', {})),
+    ('GET', '/ingredient/{id}/movements', 1, lambda menu: (f'/ingredient/{menu["ingredients"][0]}/movements', {})),
+    ('PATCH', '/ingredient/stock', 5, lambda menu: (
+        '/ingredient/stock', {'json': [{'id': id, 'delta': -1, 'reason': 'WASTE'} for id in menu['ingredients']]}
+    )),
+    ('PUT', '/position/{id}/ingredients', 5, lambda menu: (
+        f'/position/{menu["positions"][2]}/ingredients',
+        {'json': [{'id': id, 'count': 1} for id in menu['ingredients']]}
+    )),
+]
+
+
+@pytest.mark.parametrize(
+    ('method', 'route', 'measured', 'build'),
+    ROUTE_BUDGETS,
+    ids=[f'{method} {route}' for method, route, _, _ in ROUTE_BUDGETS],
+)
+async def test_statement_budget(
+    client: httpx.AsyncClient, menu: Menu, method: str, route: str, measured: int, build: Callable
+):
+    url, kwargs = build(menu)
+    # a cached menu runs no statements at all
+    menu_cache.invalidate()
+
+    with assert_statement_budget(measured + STATEMENT_MARGIN) as stats:
+        response = await client.request(method, url, **kwargs)
+
+    assert response.status_code == 200, response.text
+    assert stats.statements > 0